@@ -2,10 +2,11 @@
 # -*- coding: utf-8 -*-
 from __future__ import annotations
 
-import argparse, json
+import argparse, json, warnings
 from pathlib import Path
 import pandas as pd
 import numpy as np
+import pyarrow as pa, pyarrow.csv as pcsv, pyarrow.parquet as pq
 from datetime import datetime
 
 SUPPORTED = {".csv", ".parquet"}
@@ -13,58 +14,90 @@ SUPPORTED = {".csv", ".parquet"}
 def load_any(path: Path) -> pd.DataFrame:
     sfx = path.suffix.lower()
     if sfx == ".csv":
-        return pd.read_csv(path)
-    if sfx == ".parquet":
-        return pd.read_parquet(path)
-    raise ValueError(f"Unsupported file: {path}")
+        df = pd.read_csv(path)
+    elif sfx == ".parquet":
+        df = pd.read_parquet(path)
+    else:
+        raise ValueError(f"Unsupported file: {path}")
+    if "country" in df.columns:
+        df["country"] = df["country"].astype("category")  # group on int codes
+    return df
+
+def write_any(df: pd.DataFrame, path) -> None:
+    t = pa.Table.from_pandas(df, preserve_index=False)
+    if str(path).lower().endswith(".parquet"):
+        pq.write_table(t, path, compression="zstd")
+    else:
+        pcsv.write_csv(t, path)
 
 def month_order_key(row):
     return int(row["year"]) * 12 + int(row["month"])
 
-def lag_autocorr(series: pd.Series, lag: int) -> float | None:
-    try:
-        return float(series.autocorr(lag))
-    except Exception:
-        return None
-
-def linear_trend_slope(series: pd.Series, months_to_decade: bool = True) -> float | None:
-    # fit y = a + b*t on index t = 0..n-1; return b in °C/decade if months_to_decade
-    y = series.values
-    n = len(y)
-    if n < 3 or np.isnan(y).all():
-        return None
-    t = np.arange(n, dtype=float)
-    # mask NaNs
-    mask = ~np.isnan(y)
-    if mask.sum() < 3:
-        return None
-    t, y = t[mask], y[mask]
-    b, a = np.polyfit(t, y, 1)  # slope, intercept (numpy returns [slope, intercept])
-    if months_to_decade:
-        b = b * 120.0  # months per decade
-    return float(b)
+def sort_country_time(df: pd.DataFrame) -> pd.DataFrame:
+    # composite country/month key -> one stable int sort
+    codes = df["country"].astype("category").cat.codes.to_numpy(np.int64)
+    ym = df["year"].to_numpy(np.int64)*12 + df["month"].to_numpy(np.int64) - 1
+    ym = ym - ym.min() if len(ym) else ym
+    span = int(ym.max()) + 1 if len(ym) else 1
+    order = np.argsort(codes*span + ym, kind="stable")
+    return df.take(order).reset_index(drop=True)
+
+def _centered_sums(codes: np.ndarray, n: int, a: np.ndarray, b: np.ndarray):
+    # per-group Σ(a-ā)(b-b̄), Σ(a-ā)², Σ(b-b̄)² and pair count over rows where both a and b are valid
+    ok = ~(np.isnan(a) | np.isnan(b))
+    c, a, b = codes[ok], a[ok], b[ok]
+    cnt = np.bincount(c, minlength=n)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        a = a - (np.bincount(c, weights=a, minlength=n) / cnt)[c]
+        b = b - (np.bincount(c, weights=b, minlength=n) / cnt)[c]
+    return (np.bincount(c, weights=a*b, minlength=n), np.bincount(c, weights=a*a, minlength=n),
+            np.bincount(c, weights=b*b, minlength=n), cnt)
+
+def trend_autocorr(anom: np.ndarray, codes: np.ndarray, n: int, lag: int = 12):
+    """
+    Lag autocorrelation (Pearson x_t vs. x_{t-lag}) and OLS trend (per month) per group
+    in one flat pass over contiguous rows sorted by (group, time).
+    """
+    starts = np.flatnonzero(np.r_[True, codes[1:] != codes[:-1]])
+    t = np.arange(len(codes)) - starts[codes]
+    lagged = np.full(len(anom), np.nan)
+    lagged[lag:] = anom[:-lag]
+    lagged[t < lag] = np.nan
+    sxy, sxx, syy, npair = _centered_sums(codes, n, anom, lagged)
+    sty, _, stt, _ = _centered_sums(codes, n, anom, t.astype(float))
+    with np.errstate(invalid="ignore", divide="ignore"):
+        den = np.sqrt(sxx * syy)
+        ac = np.where((den > 0) & (npair >= 2), sxy / den, np.nan)
+        slope = sty / stt
+    return ac, slope
 
 def per_country_stats(df: pd.DataFrame, min_len: int = 24) -> pd.DataFrame:
-    out_rows = []
-    for country, g in df.groupby("country", sort=True):
-        g = g.sort_values(["year","month"])
-        s = g["anomaly_c"].astype(float)
-        n = len(s)
-        valid = int(s.notna().sum())
-        ac_lag12 = lag_autocorr(s, 12) if n >= 13 else None
-        slope_dec = linear_trend_slope(s) if n >= 12 else None
-        mean_anom = float(np.nanmean(s)) if valid > 0 else None
-        std_anom = float(np.nanstd(s, ddof=1)) if valid > 1 else None
-        out_rows.append({
-            "country": country,
-            "n_rows": n,
-            "n_valid_anomaly": valid,
-            "autocorr_lag12": ac_lag12,
-            "trend_decade_c": slope_dec,
-            "mean_anomaly_c": mean_anom,
-            "std_anomaly_c": std_anom
-        })
-    return pd.DataFrame(out_rows).sort_values("country")
+    g = sort_country_time(df)
+    cat = g["country"].astype("category")
+    countries = cat.cat.categories
+    codes = cat.cat.codes.to_numpy(np.int32)
+    n = len(countries)
+    x = g["anomaly_c"].to_numpy(dtype=float)
+    valid = ~np.isnan(x)
+
+    n_rows = np.bincount(codes, minlength=n)
+    n_valid = np.bincount(codes, weights=valid, minlength=n).astype(int)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean = np.bincount(codes[valid], weights=x[valid], minlength=n) / n_valid
+        dev = x[valid] - mean[codes[valid]]
+        std = np.sqrt(np.bincount(codes[valid], weights=dev*dev, minlength=n) / (n_valid - 1))
+    std[n_valid < 2] = np.nan
+
+    ac, slope = trend_autocorr(x, codes, n)
+    return pd.DataFrame({
+        "country": countries,
+        "n_rows": n_rows,
+        "n_valid_anomaly": n_valid,
+        "autocorr_lag12": np.where(n_rows >= 13, ac, np.nan),
+        "trend_decade_c": np.where((n_rows >= 12) & (n_valid >= 3), slope * 120.0, np.nan),  # months per decade
+        "mean_anomaly_c": mean,
+        "std_anomaly_c": std,
+    })[n_rows > 0].reset_index(drop=True)  # drop unused categories
 
 def main():
     ap = argparse.ArgumentParser(description="Step 9: Sanity & persistence checks on monthly anomalies per country.")
@@ -87,25 +120,30 @@ def main():
 
     # write CSV
     Path(args.report_csv).parent.mkdir(parents=True, exist_ok=True)
-    stats.to_csv(args.report_csv, index=False)
+    write_any(stats, args.report_csv)
 
-    # meta + global summary
+    # meta + global summary (directly on the arrays, one row per country)
+    ac = stats["autocorr_lag12"].to_numpy()
+    tr = stats["trend_decade_c"].to_numpy()
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", RuntimeWarning)  # all-NaN -> NaN, like Series.median
+        med_ac, med_tr = np.nanmedian(ac), np.nanmedian(tr)
     meta = {
         "timestamp": datetime.utcnow().isoformat() + "Z",
         "anomalies": str(anomalies_path),
-        "countries": int(stats["country"].nunique()),
+        "countries": int(len(stats)),
         "rows_anomalies": int(len(df)),
         "global_summary": {
-            "median_autocorr_lag12": float(stats["autocorr_lag12"].median(skipna=True)) if "autocorr_lag12" in stats else None,
-            "median_trend_decade_c": float(stats["trend_decade_c"].median(skipna=True)) if "trend_decade_c" in stats else None,
-            "share_autocorr_lag12_pos": float((stats["autocorr_lag12"] > 0).mean())
+            "median_autocorr_lag12": float(med_ac),
+            "median_trend_decade_c": float(med_tr),
+            "share_autocorr_lag12_pos": float(np.mean(ac > 0)) if len(ac) else float("nan")
         }
     }
-    with open(args.report_json, "w", encoding="utf-8") as f:
-        json.dump(meta, f, indent=2)
+    meta_txt = json.dumps(meta, indent=2)  # serialize once, for the file and stdout
+    Path(args.report_json).write_text(meta_txt, encoding="utf-8")
 
     print("[OK] Step 9 report written:", args.report_csv)
-    print(json.dumps(meta, indent=2))
+    print(meta_txt)
 
 if __name__ == "__main__":
     main()
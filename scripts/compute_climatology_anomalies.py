@@ -3,9 +3,11 @@
 from __future__ import annotations
 
 import argparse, json
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 import pandas as pd
 import numpy as np
+import pyarrow as pa, pyarrow.csv as pcsv, pyarrow.parquet as pq
 from datetime import datetime
 
 SUPPORTED = {".csv", ".parquet", ".feather"}
@@ -13,15 +15,23 @@ SUPPORTED = {".csv", ".parquet", ".feather"}
 def load_any(path: Path) -> pd.DataFrame:
     sfx = path.suffix.lower()
     if sfx == ".csv":
-        return pd.read_csv(path)
+        return pd.read_csv(path, engine="pyarrow")
     if sfx == ".parquet":
-        return pd.read_parquet(path)
+        return pd.read_parquet(path, engine="pyarrow")
     if sfx == ".feather":
         return pd.read_feather(path)
     raise ValueError(f"Unsupported file: {path}")
 
+def write_any(df: pd.DataFrame, path) -> None:
+    # Arrow-Writer für beide Ausgaben (CSV oder Parquet/zstd)
+    t = pa.Table.from_pandas(df, preserve_index=False)
+    if str(path).lower().endswith(".parquet"):
+        pq.write_table(t, path, compression="zstd")
+    else:
+        pcsv.write_csv(t, path)
+
 def ensure_cols(df: pd.DataFrame, src: Path) -> pd.DataFrame:
-    df = df.copy()
+    # df is a fresh frame from load_any -> add columns in place; the final column selection copies once
     if "country" not in df.columns:
         df["country"] = src.stem
     if ("year" not in df.columns or "month" not in df.columns) and "date" in df.columns:
@@ -31,19 +41,23 @@ def ensure_cols(df: pd.DataFrame, src: Path) -> pd.DataFrame:
     for req in ["year","month","temp_c"]:
         if req not in df.columns:
             raise SystemExit(f"{src.name}: missing required column '{req}'")
-    # sanitize
-    df["year"] = df["year"].astype(int)
-    df["month"] = df["month"].astype(int)
+    # sanitize + downcast (float32 reicht für Monatstemperaturen, halbiert Speicher/Bandbreite)
+    df["year"] = df["year"].astype(np.int16)
+    df["month"] = df["month"].astype(np.int8)
+    df["temp_c"] = df["temp_c"].astype(np.float32)
     return df[["country","year","month","temp_c"]]
 
 def read_per_country(input_dir: Path) -> pd.DataFrame:
     files = [p for p in input_dir.iterdir() if p.is_file() and p.suffix.lower() in SUPPORTED]
     if not files:
         raise SystemExit(f"No data files found in {input_dir}")
-    frames = []
-    for p in sorted(files):
-        frames.append(ensure_cols(load_any(p), p))
-    return pd.concat(frames, ignore_index=True)
+    # IO/parse-bound and independent per file -> overlap reads in a thread pool (order preserved by map)
+    with ThreadPoolExecutor(max_workers=min(16, len(files))) as ex:
+        frames = list(ex.map(lambda p: ensure_cols(load_any(p), p), sorted(files)))
+    df = pd.concat(frames, ignore_index=True)
+    # country einmal als Categorical -> groupby über int-Codes statt String-Hashing
+    df["country"] = df["country"].astype("category")
+    return df
 
 def read_reference(ref_csv: Path, default_start: int, default_end: int) -> pd.DataFrame:
     if ref_csv and ref_csv.exists():
@@ -56,8 +70,10 @@ def read_reference(ref_csv: Path, default_start: int, default_end: int) -> pd.Da
     # no ref file -> single default for all
     return None
 
-def compute_climatology(df: pd.DataFrame, ref: pd.DataFrame|None, default_start: int, default_end: int) -> pd.DataFrame:
+def attach_reference(df: pd.DataFrame, ref: pd.DataFrame|None, default_start: int, default_end: int) -> pd.DataFrame:
     if ref is not None:
+        # gleiche Kategorien wie df, sonst fällt der Merge-Key auf object zurück
+        ref = ref.assign(country=pd.Categorical(ref["country"], categories=df["country"].cat.categories))
         dfm = df.merge(ref, on="country", how="left")
         dfm["ref_start"] = dfm["ref_start"].fillna(default_start)
         dfm["ref_end"] = dfm["ref_end"].fillna(default_end)
@@ -65,17 +81,25 @@ def compute_climatology(df: pd.DataFrame, ref: pd.DataFrame|None, default_start:
         dfm = df.copy()
         dfm["ref_start"] = default_start
         dfm["ref_end"] = default_end
-    in_ref = (dfm["year"] >= dfm["ref_start"]) & (dfm["year"] <= dfm["ref_end"])
-    ref_df = dfm.loc[in_ref, ["country","month","temp_c","ref_start","ref_end"]]
+    return dfm
+
+def in_reference(dfm: pd.DataFrame) -> pd.Series:
+    return (dfm["year"] >= dfm["ref_start"]) & (dfm["year"] <= dfm["ref_end"])
+
+def compute_climatology(dfm: pd.DataFrame) -> pd.DataFrame:
+    ref_df = dfm.loc[in_reference(dfm), ["country","month","temp_c","ref_start","ref_end"]]
     clim = (ref_df
-            .groupby(["country","month","ref_start","ref_end"], as_index=False)["temp_c"]
+            .groupby(["country","month","ref_start","ref_end"], as_index=False, observed=True)["temp_c"]
             .mean()
             .rename(columns={"temp_c":"clim_temp_c"}))
     return clim
 
-def compute_anomalies(df: pd.DataFrame, clim: pd.DataFrame) -> pd.DataFrame:
-    out = df.merge(clim[["country","month","clim_temp_c"]], on=["country","month"], how="left")
-    out["anomaly_c"] = out["temp_c"] - out["clim_temp_c"]
+def compute_anomalies(dfm: pd.DataFrame) -> pd.DataFrame:
+    # climatology broadcast back onto every row via transform -> no join against the clim table
+    clim = dfm["temp_c"].where(in_reference(dfm)).groupby([dfm["country"], dfm["month"]], observed=True, sort=False).transform("mean")
+    out = dfm.drop(columns=["ref_start","ref_end"])
+    out["clim_temp_c"] = clim
+    out["anomaly_c"] = out["temp_c"] - clim
     return out
 
 def main():
@@ -94,21 +118,16 @@ def main():
     ref = Path(args.ref_csv) if args.ref_csv else None
     ref_df = read_reference(ref, args.default_start, args.default_end) if ref else None
 
-    clim = compute_climatology(df, ref_df, args.default_start, args.default_end)
+    dfm = attach_reference(df, ref_df, args.default_start, args.default_end)
+    clim = compute_climatology(dfm)
     # Save climatology
     Path(args.output_climatology).parent.mkdir(parents=True, exist_ok=True)
-    if args.output_climatology.lower().endswith(".parquet"):
-        clim.to_parquet(args.output_climatology, index=False)
-    else:
-        clim.to_csv(args.output_climatology, index=False)
+    write_any(clim, args.output_climatology)
 
     # Anomalies
-    anomalies = compute_anomalies(df, clim)
+    anomalies = compute_anomalies(dfm)
     Path(args.output_anomalies).parent.mkdir(parents=True, exist_ok=True)
-    if args.output_anomalies.lower().endswith(".parquet"):
-        anomalies.to_parquet(args.output_anomalies, index=False)
-    else:
-        anomalies.to_csv(args.output_anomalies, index=False)
+    write_any(anomalies, args.output_anomalies)
 
     meta = {
         "timestamp": datetime.utcnow().isoformat() + "Z",
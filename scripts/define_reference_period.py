@@ -2,9 +2,12 @@
 # -*- coding: utf-8 -*-
 from __future__ import annotations
 import argparse, json
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
 from pathlib import Path
 import pandas as pd
 import numpy as np
+import pyarrow as pa, pyarrow.csv as pcsv, pyarrow.parquet as pq
 from datetime import datetime
 
 DEFAULT_MIN_PER_MONTH = 25
@@ -19,8 +22,15 @@ def load_any(path: Path) -> pd.DataFrame:
     if sfx == ".feather": return pd.read_feather(path)
     raise ValueError(f"Unsupported file: {path}")
 
+def write_any(df: pd.DataFrame, path) -> None:
+    t = pa.Table.from_pandas(df, preserve_index=False)
+    if str(path).lower().endswith(".parquet"):
+        pq.write_table(t, path, compression="zstd")
+    else:
+        pcsv.write_csv(t, path)
+
 def ensure_cols(df: pd.DataFrame, src: Path) -> pd.DataFrame:
-    df = df.copy()
+    # df is a fresh frame from load_any -> add columns in place; the final column selection copies once
     if "country" not in df.columns: df["country"] = src.stem
     if ("year" not in df.columns or "month" not in df.columns) and "date" in df.columns:
         dt = pd.to_datetime(df["date"], errors="coerce")
@@ -31,43 +41,61 @@ def ensure_cols(df: pd.DataFrame, src: Path) -> pd.DataFrame:
             raise SystemExit(f"{src.name}: missing required column '{req}'")
     return df[["country","year","month","temp_c"]]
 
-def years_in_window(df, y0, y1):
-    return df[(df["year"]>=y0) & (df["year"]<=y1)]
+def month_presence_cumsum(df, ymin, ymax):
+    # (year, month) -> 1 if any row exists; cum[i] = per-month count of present years < ymin+i
+    d = df[["year","month"]].dropna()
+    d = d[d["month"].between(1, 12)]
+    present = np.zeros((ymax - ymin + 1, 12), dtype=np.int32)
+    present[d["year"].to_numpy(dtype=int) - ymin, d["month"].to_numpy(dtype=int) - 1] = 1
+    return np.vstack([np.zeros((1, 12), dtype=np.int32), np.cumsum(present, axis=0)])
 
-def window_score(dfw, n_min):
-    counts = dfw.groupby("month")["year"].nunique().reindex(range(1,13), fill_value=0)
-    months_meeting = int((counts >= n_min).sum())
-    total_obs = int(counts.sum())
-    return months_meeting, total_obs
+def window_counts(cum, ymin, ymax, starts, ends):
+    # unique years per month for every window [start, end] at once -> shape (n_windows, 12)
+    lo = np.clip(starts, ymin, ymax + 1) - ymin
+    hi = np.clip(ends + 1, ymin, ymax + 1) - ymin
+    return cum[hi] - cum[lo]
 
 def choose_window(df, default=(1981,2010), n_min=25):
     years = df["year"].dropna().astype(int)
     if years.empty:
         return {"ok": False, "reason": "no_years"}
     ymin, ymax = int(years.min()), int(years.max())
+    cum = month_presence_cumsum(df, ymin, ymax)
     d0, d1 = default
-    df_def = years_in_window(df, d0, d1)
-    mmeet, tobs = window_score(df_def, n_min)
+    counts = window_counts(cum, ymin, ymax, np.array([d0]), np.array([d1]))[0]
+    mmeet, tobs = int((counts >= n_min).sum()), int(counts.sum())
     if mmeet == 12:
         return {"ok": True, "start": d0, "end": d1, "months_meeting": mmeet, "total_obs": tobs, "fallback": False}
-    best = None
-    default_center = (d0 + d1)/2.0
-    for start in range(ymin, ymax - WINDOW_LEN + 2):
-        end = start + WINDOW_LEN - 1
-        dfw = years_in_window(df, start, end)
-        mmeet, tobs = window_score(dfw, n_min)
-        candidate = {"start": start, "end": end, "months_meeting": mmeet, "total_obs": tobs}
-        if best is None or (mmeet, tobs) > (best["months_meeting"], best["total_obs"]) or (
-            (mmeet, tobs) == (best["months_meeting"], best["total_obs"]) and abs((start+end)/2.0 - default_center) < abs((best["start"]+best["end"])/2.0 - default_center)
-        ):
-            best = candidate
-    if best is None:
+    starts = np.arange(ymin, ymax - WINDOW_LEN + 2)
+    if starts.size == 0:
         return {"ok": False, "reason": "no_window"}
-    ok = best["months_meeting"] == 12
+    ends = starts + WINDOW_LEN - 1
+    counts = window_counts(cum, ymin, ymax, starts, ends)
+    mmeet, tobs = (counts >= n_min).sum(axis=1), counts.sum(axis=1)
+    dist = np.abs((starts + ends)/2.0 - (d0 + d1)/2.0)
+    # best = most months meeting, then most obs, then closest to default center, then earliest start
+    i = np.lexsort((starts, dist, -tobs, -mmeet))[0]
+    best = {"start": int(starts[i]), "end": int(ends[i]), "months_meeting": int(mmeet[i]), "total_obs": int(tobs[i])}
     best["fallback"] = True
-    best["ok"] = ok
+    best["ok"] = best["months_meeting"] == 12
     return best
 
+def assess_file(p: Path, default: tuple[int,int], n_min: int) -> dict:
+    df = ensure_cols(load_any(p), p)
+    choice = choose_window(df, default=default, n_min=n_min)
+    return {
+        "country": str(df["country"].iloc[0]),
+        "default_start": default[0],
+        "default_end": default[1],
+        "chosen_start": choice.get("start"),
+        "chosen_end": choice.get("end"),
+        "months_meeting_min": choice.get("months_meeting"),
+        "total_month_counts": choice.get("total_obs"),
+        "fallback_used": bool(choice.get("fallback", False)),
+        "ok_full_coverage": bool(choice.get("ok", False)),
+        "reason_if_not_ok": choice.get("reason")
+    }
+
 def main():
     ap = argparse.ArgumentParser(description="Define per-country 30y reference periods for monthly climatology.")
     ap.add_argument("--input_dir", required=True)
@@ -82,27 +110,13 @@ def main():
     files = [p for p in input_dir.iterdir() if p.is_file() and p.suffix.lower() in SUPPORTED]
     if not files:
         raise SystemExit(f"No data files found in {input_dir}")
-    rows = []
-    for p in sorted(files):
-        df = ensure_cols(load_any(p), p)
-        choice = choose_window(df, default=(args.default_start, args.default_end), n_min=args.min_per_month)
-        country = str(df["country"].iloc[0])
-        row = {
-            "country": country,
-            "default_start": args.default_start,
-            "default_end": args.default_end,
-            "chosen_start": choice.get("start"),
-            "chosen_end": choice.get("end"),
-            "months_meeting_min": choice.get("months_meeting"),
-            "total_month_counts": choice.get("total_obs"),
-            "fallback_used": bool(choice.get("fallback", False)),
-            "ok_full_coverage": bool(choice.get("ok", False)),
-            "reason_if_not_ok": choice.get("reason")
-        }
-        rows.append(row)
+    # one independent read + window search per file -> spread across processes
+    job = partial(assess_file, default=(args.default_start, args.default_end), n_min=args.min_per_month)
+    with ProcessPoolExecutor() as ex:
+        rows = list(ex.map(job, sorted(files)))
     out = pd.DataFrame(rows).sort_values("country")
     Path(args.report_csv).parent.mkdir(parents=True, exist_ok=True)
-    out.to_csv(args.report_csv, index=False)
+    write_any(out, args.report_csv)
     meta = {
         "timestamp": datetime.utcnow().isoformat() + "Z",
         "input_dir": str(input_dir),
@@ -112,10 +126,10 @@ def main():
         "n_ok_full": int(out["ok_full_coverage"].sum()),
         "n_fallback": int(out["fallback_used"].sum()),
     }
-    with open(args.report_json, "w", encoding="utf-8") as f:
-        json.dump(meta, f, indent=2)
+    meta_txt = json.dumps(meta, indent=2)  # einmal serialisieren, für Datei und stdout
+    Path(args.report_json).write_text(meta_txt, encoding="utf-8")
     print("[OK] Reference periods written:", args.report_csv)
-    print(json.dumps(meta, indent=2))
+    print(meta_txt)
 
 if __name__ == "__main__":
     main()
@@ -5,32 +5,130 @@ import argparse
 from pathlib import Path
 import pandas as pd
 import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+import pyarrow as pa, pyarrow.csv as pcsv, pyarrow.parquet as pq
 
 def load_df(path: Path)->pd.DataFrame:
     if path.suffix.lower()==".csv":
-        return pd.read_csv(path)
-    if path.suffix.lower()==".parquet":
-        return pd.read_parquet(path)
-    raise SystemExit(f"Unsupported file: {path}")
+        df = pd.read_csv(path, engine="pyarrow")
+    elif path.suffix.lower()==".parquet":
+        df = pd.read_parquet(path, engine="pyarrow")
+    elif path.suffix.lower()==".feather":
+        df = pd.read_feather(path)
+    else:
+        raise SystemExit(f"Unsupported file: {path}")
+    if "country" in df.columns:
+        df["country"] = df["country"].astype("category")  # groupby über int-Codes
+    return df
+
+def write_df(df: pd.DataFrame, path, batch_rows: int = 1 << 16) -> None:
+    # pyarrow statt to_csv, in RecordBatches geschrieben (Parquet: eine Row-Group je Batch, zstd)
+    t = pa.Table.from_pandas(df, preserve_index=False)
+    if str(path).lower().endswith(".parquet"):
+        w = pq.ParquetWriter(path, t.schema, compression="zstd")
+    else:
+        w = pcsv.CSVWriter(path, t.schema)
+    with w:
+        for batch in t.to_batches(max_chunksize=batch_rows):
+            w.write_batch(batch)
 
 def add_calendar(df: pd.DataFrame)->pd.DataFrame:
-    d = df.copy()
-    d["mon_sin"] = np.sin(2*np.pi*d["month"].astype(float)/12.0)
-    d["mon_cos"] = np.cos(2*np.pi*d["month"].astype(float)/12.0)
-    return d
+    ang = 2*np.pi*df["month"].to_numpy(dtype=np.float32)/np.float32(12.0)
+    return df.assign(mon_sin=np.sin(ang), mon_cos=np.cos(ang))
 
-def add_persistence(df: pd.DataFrame)->pd.DataFrame:
-    def f(g: pd.DataFrame)->pd.DataFrame:
-        g = g.sort_values(["year","month"]).copy()
-        # persistence (leakage-frei: rollings auf shift(1))
-        g["anom_lag1"]   = g["anomaly_c"].shift(1)
-        g["anom_lag12"]  = g["anomaly_c"].shift(12)
-        g["anom_lag24"]  = g["anomaly_c"].shift(24)
-        g["roll_mean_3"] = g["anomaly_c"].shift(1).rolling(3,  min_periods=3).mean()
-        g["roll_std_3"]  = g["anomaly_c"].shift(1).rolling(3,  min_periods=3).std(ddof=0)
-        g["roll_mean_12"]= g["anomaly_c"].shift(1).rolling(12, min_periods=12).mean()
-        return g
-    return df.groupby("country", group_keys=False).apply(f)
+def group_pos(df: pd.DataFrame)->tuple[np.ndarray, np.ndarray]:
+    """
+    Position jeder Zeile in ihrem Länderblock (von vorne t, von hinten te).
+    Erwartet nach country/year/month sortierte, zusammenhängende Blöcke.
+    """
+    codes = df["country"].astype("category").cat.codes.to_numpy()
+    n = len(codes)
+    starts = np.flatnonzero(np.r_[True, codes[1:] != codes[:-1]]) if n else np.zeros(0, dtype=int)
+    grp = np.repeat(np.arange(len(starts)), np.diff(np.r_[starts, n]))
+    t = np.arange(n) - starts[grp]
+    te = np.r_[starts[1:], n][grp] - 1 - np.arange(n)
+    return t, te
+
+def shift_in_group(a: np.ndarray, k: int, t: np.ndarray, te: np.ndarray)->np.ndarray:
+    # wie groupby.shift(k) auf dem flachen Array: Werte über Blockgrenzen -> NaN
+    out = np.full(len(a), np.nan, dtype=a.dtype)
+    if k > 0:
+        out[k:] = a[:-k]
+        out[t < k] = np.nan
+    elif k < 0:
+        out[:k] = a[-k:]
+        out[te < -k] = np.nan
+    else:
+        out[:] = a
+    return out
+
+def rolling_in_group(x: np.ndarray, w: int, min_periods: int, t: np.ndarray, std: bool = False)->np.ndarray:
+    """
+    Rolling mean (bzw. std, ddof=0) über die letzten w Werte je Block; Ergebnis NaN bei < min_periods gültigen Werten.
+    Mean: Präfixsummen je Block (Summe und Anzahl gültiger Werte), O(N) Speicher auch für w=36.
+    Std: Strided-Fenster (N, w) mit Abweichungen vom Fenstermittel (keine Auslöschung); nur für kleine w gedacht.
+    """
+    x = x.astype(float)
+    n = len(x)
+    i = np.arange(n)
+    if std:
+        win = sliding_window_view(np.r_[np.full(w-1, np.nan), x], w).copy()
+        win[np.arange(w)[None, :] < (w-1-t)[:, None]] = np.nan
+        ok = ~np.isnan(win)
+        cnt = ok.sum(axis=1)
+        win[~ok] = 0.0
+        with np.errstate(invalid="ignore", divide="ignore"):
+            mean = win.sum(axis=1) / cnt
+            dev = np.where(ok, win - mean[:, None], 0.0)
+            res = np.sqrt((dev*dev).sum(axis=1) / cnt)
+        res[cnt < min_periods] = np.nan
+        return res
+    ok = ~np.isnan(x)
+    v = np.where(ok, x, 0.0)
+    # Präfixsummen blockweise neu gestartet, damit keine Rundungsfehler aus früheren Ländern mitlaufen
+    csum, ccnt = np.empty(n), np.empty(n, dtype=np.int64)
+    starts = np.flatnonzero(t == 0)
+    for s0, e0 in zip(starts, np.r_[starts[1:], n]):
+        csum[s0:e0] = np.cumsum(v[s0:e0])
+        ccnt[s0:e0] = np.cumsum(ok[s0:e0])
+    lo = i - np.minimum(w-1, t)        # erster Fensterplatz im Block
+    inner = lo > i - t                  # Fenster beginnt nach dem Blockanfang -> Präfix davor abziehen
+    prev = np.maximum(lo - 1, 0)
+    tot = csum - np.where(inner, csum[prev], 0.0)
+    cnt = ccnt - np.where(inner, ccnt[prev], 0)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        res = tot / cnt
+    res[cnt < min_periods] = np.nan
+    return res
+
+def sort_country_time(df: pd.DataFrame) -> pd.DataFrame:
+    # ein stabiler Sort über einen int64-Schlüssel (country-Code, year*12+month) statt Lex-Sort über 3 Spalten
+    codes = df["country"].astype("category").cat.codes.to_numpy(np.int64)
+    ym = df["year"].to_numpy(np.int64)*12 + df["month"].to_numpy(np.int64) - 1
+    ym = ym - ym.min() if len(ym) else ym
+    span = int(ym.max()) + 1 if len(ym) else 1
+    order = np.argsort(codes*span + ym, kind="stable")
+    return df.take(order).reset_index(drop=True)
+
+def add_features(df: pd.DataFrame)->pd.DataFrame:
+    """
+    Persistence-Features und Target in einem Pass: einmal sortieren, dann flache
+    NumPy-Kernels mit Korrektur an den Ländergrenzen (kein groupby).
+    - anom_lag1/12/24 und rollings (leakage-frei: rollings auf shift(1))
+    - target_anom_t_plus_1 = anomaly_c der Folgeperiode
+    """
+    df = sort_country_time(df)
+    t, te = group_pos(df)
+    a = df["anomaly_c"].to_numpy()
+    lag1 = shift_in_group(a, 1, t, te)
+    df["anom_lag1"]  = lag1
+    df["anom_lag12"] = shift_in_group(a, 12, t, te)
+    df["anom_lag24"] = shift_in_group(a, 24, t, te)
+    df["target_anom_t_plus_1"] = shift_in_group(a, -1, t, te)
+    df["roll_mean_3"] = rolling_in_group(lag1, 3, 3, t)
+    df["roll_std_3"]  = rolling_in_group(lag1, 3, 3, t, std=True)
+    df["roll_mean_12"]= rolling_in_group(lag1, 12, 12, t)
+    return df
 
 def add_trend_features(df: pd.DataFrame)->pd.DataFrame:
     """
@@ -38,35 +136,25 @@ def add_trend_features(df: pd.DataFrame)->pd.DataFrame:
     - trend_k_norm: zentrierter, skalierten Zeitindex (~ 10 Jahre ≈ 0.83)
     - recent_trend_36: Differenz der gleitenden Mittel (letzte 36 Monate vs. 36 Monate davor),
       leakage-frei: beide Fenster auf anomaly_c.shift(1)
+    Erwartet die nach country/year/month sortierte Frame aus add_features.
     """
-    d = df.copy()
     # globaler Zeitindex
-    d["k"] = d["year"].astype(int)*12 + (d["month"].astype(int)-1)
+    d = df.assign(k=df["year"].astype(int)*12 + (df["month"].astype(int)-1))
     k_mean = d["k"].mean()
     d["trend_k_norm"] = (d["k"] - k_mean) / 120.0  # 120 ~ 10 Jahre
 
     # jüngster Erwärmungsimpuls je Land (leakage-frei)
-    def gfun(g: pd.DataFrame)->pd.DataFrame:
-        g = g.sort_values(["year","month"]).copy()
-        s = g["anomaly_c"].shift(1)  # nur Vergangenheit
-        g["roll_mean_last36"] = s.rolling(36, min_periods=12).mean()
-        g["roll_mean_prev36"] = s.shift(36).rolling(36, min_periods=12).mean()
-        g["recent_trend_36"]  = g["roll_mean_last36"] - g["roll_mean_prev36"]
-        return g
-    d = d.groupby("country", group_keys=False).apply(gfun)
+    t, te = group_pos(d)
+    s = shift_in_group(d["anomaly_c"].to_numpy(), 1, t, te)  # nur Vergangenheit
+    d["roll_mean_last36"] = rolling_in_group(s, 36, 12, t)
+    d["roll_mean_prev36"] = rolling_in_group(shift_in_group(s, 36, t, te), 36, 12, t)
+    d["recent_trend_36"]  = d["roll_mean_last36"] - d["roll_mean_prev36"]
     return d
 
-def add_target(df: pd.DataFrame)->pd.DataFrame:
-    def f(g: pd.DataFrame)->pd.DataFrame:
-        g = g.sort_values(["year","month"]).copy()
-        g["target_anom_t_plus_1"] = g["anomaly_c"].shift(-1)
-        return g
-    return df.groupby("country", group_keys=False).apply(f)
-
 def main():
     ap = argparse.ArgumentParser(description="Phase 3 – Build features_v1 (leakage-free) with trend features.")
     ap.add_argument("--anomalies", required=True)
-    ap.add_argument("--out_features", required=True)
+    ap.add_argument("--out_features", required=True, help="Output file (.csv or .parquet).")
     ap.add_argument("--drop_optional", action="store_true")
     args = ap.parse_args()
 
@@ -77,9 +165,8 @@ def main():
         raise SystemExit(f"Missing columns: {miss}")
 
     d = add_calendar(df)
-    d = add_persistence(d)
+    d = add_features(d)         # Persistence + Target (sortiert nach country/year/month)
     d = add_trend_features(d)   # <- NEU: Trend-Features
-    d = add_target(d)
 
     # Kernfeatures müssen vorhanden sein (für Learner & Target)
     core = ["anom_lag1","anom_lag12","roll_mean_3","roll_std_3","target_anom_t_plus_1"]
@@ -101,9 +188,9 @@ def main():
 
     cols = base_cols if args.drop_optional else base_cols + opt_cols
 
-    out = d[cols].dropna(subset=core, how="any").copy()
+    out = d[cols].dropna(subset=core, how="any")
     Path(args.out_features).parent.mkdir(parents=True, exist_ok=True)
-    out.to_csv(args.out_features, index=False)
+    write_df(out, args.out_features)
     print("[OK] features_v1 written:", args.out_features, "rows:", len(out))
 
 if __name__ == "__main__":
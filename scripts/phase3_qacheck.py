@@ -7,24 +7,42 @@ import pandas as pd
 import numpy as np
 from datetime import datetime
 
+def load_df(path: Path)->pd.DataFrame:
+    if path.suffix.lower()==".csv":
+        df = pd.read_csv(path, engine="pyarrow")
+    elif path.suffix.lower()==".parquet":
+        df = pd.read_parquet(path, engine="pyarrow")
+    elif path.suffix.lower()==".feather":
+        df = pd.read_feather(path)
+    else:
+        raise SystemExit(f"Unsupported file: {path}")
+    if "country" in df.columns:
+        df["country"] = df["country"].astype("category")  # groupby über int-Codes
+    return df
+
 def main():
     ap = argparse.ArgumentParser(description="Phase 3 – QA checks on features_v1")
-    ap.add_argument("--features_csv", required=True)
+    ap.add_argument("--features_csv", required=True, help="features_v1 (.csv or .parquet)")
     ap.add_argument("--out_md", required=True)
     args = ap.parse_args()
 
-    df = pd.read_csv(args.features_csv)
+    df = load_df(Path(args.features_csv))
     req = {"country","anomaly_c","target_anom_t_plus_1","anom_lag1","anom_lag12","roll_mean_3","roll_std_3","mon_sin","mon_cos"}
     miss = [c for c in req if c not in df.columns]
     if miss: raise SystemExit(f"Missing columns: {miss}")
 
-    # correlations
-    rows = []
-    for country, g in df.groupby("country"):
-        g = g[["target_anom_t_plus_1","anom_lag1"]].dropna()
-        if len(g) >= 12:
-            rows.append({"country": country, "corr_target_vs_lag1": float(g.corr().iloc[0,1])})
-    corr_df = pd.DataFrame(rows).sort_values("corr_target_vs_lag1", ascending=False)
+    # correlations (Pearson je Land in geschlossener Form, ein groupby statt Schleife)
+    sub = df[["country","target_anom_t_plus_1","anom_lag1"]].dropna()
+    x = sub["target_anom_t_plus_1"].to_numpy(dtype=float)
+    y = sub["anom_lag1"].to_numpy(dtype=float)
+    sums = (pd.DataFrame({"x": x, "y": y, "xx": x*x, "yy": y*y, "xy": x*y}, index=sub.index)
+            .groupby(sub["country"], sort=False, observed=True).agg("sum"))
+    n = sub.groupby("country", sort=False, observed=True).size()
+    sums = sums[n >= 12]; n = n[n >= 12]
+    num = n*sums["xy"] - sums["x"]*sums["y"]
+    den = np.sqrt((n*sums["xx"] - sums["x"]**2) * (n*sums["yy"] - sums["y"]**2))
+    corr_df = ((num/den.where(den > 0)).rename("corr_target_vs_lag1").rename_axis("country").reset_index()
+               .sort_values("corr_target_vs_lag1", ascending=False))
 
     # na shares
     na = df.isna().mean().sort_values(ascending=False).reset_index()
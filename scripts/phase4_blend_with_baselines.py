@@ -4,17 +4,40 @@ import argparse, json
 from pathlib import Path
 import numpy as np
 import pandas as pd
+import pyarrow as pa, pyarrow.csv as pcsv, pyarrow.parquet as pq
 
 KEYS = ["country","year","month","cutoff_ym","horizon"]
 
 def load_buckets(p):
     return json.load(open(p, "r", encoding="utf-8"))["buckets"]
 
-def bucket_name(h, buckets):
-    for b in buckets:
-        if b["h_start"] <= h <= b["h_end"]:
-            return b["name"]
-    return "h_na"
+def read_tab(p):
+    p = Path(p)
+    if p.suffix.lower() == ".parquet":
+        return pd.read_parquet(p, engine="pyarrow")
+    if p.suffix.lower() == ".feather":
+        return pd.read_feather(p)
+    return pd.read_csv(p, engine="pyarrow")
+
+def write_tab(df: pd.DataFrame, path) -> None:
+    t = pa.Table.from_pandas(df, preserve_index=False)
+    if str(path).lower().endswith(".parquet"):
+        pq.write_table(t, path, compression="zstd")
+    else:
+        pcsv.write_csv(t, path)
+
+def bucket_names(h, buckets):
+    # vektorisiert: Bucket per Binärsuche über die sortierten h_start-Grenzen, außerhalb -> "h_na";
+    # als Categorical, damit spätere Lookups je Bucket über die Codes laufen
+    bs = sorted(buckets, key=lambda b: b["h_start"])
+    starts = np.array([b["h_start"] for b in bs])
+    ends = np.array([b["h_end"] for b in bs])
+    names = np.array([b["name"] for b in bs] + ["h_na"], dtype=object)
+    h = np.asarray(h, dtype=np.int64)
+    idx = np.searchsorted(starts, h, side="right") - 1
+    pos = np.clip(idx, 0, len(bs) - 1)
+    idx = np.where((idx >= 0) & (h <= ends[pos]), idx, len(bs))
+    return pd.Categorical.from_codes(idx, categories=names)
 
 def main():
     ap = argparse.ArgumentParser(description="Blend model forecasts with baselines (safe left-join + fallback).")
@@ -26,37 +49,39 @@ def main():
     ap.add_argument("--buckets_to_opt", nargs="*", default=["h07_12","h13_24"])
     ap.add_argument("--w_min", type=float, default=0.0)
     ap.add_argument("--w_max", type=float, default=0.8)
-    ap.add_argument("--grid_steps", type=int, default=41)
+    ap.add_argument("--grid_steps", type=int, default=41, help="unused; weights are solved in closed form (kept for CLI compatibility)")
     args = ap.parse_args()
 
     buckets = load_buckets(args.setup_json)
 
-    m = pd.read_csv(args.model_forecasts)
-    c = pd.read_csv(args.baseline_clim)[KEYS+["pred_c"]].rename(columns={"pred_c":"pred_c_clim"})
-    l = pd.read_csv(args.baseline_lag12)[KEYS+["pred_c"]].rename(columns={"pred_c":"pred_c_lag12"})
+    m = read_tab(args.model_forecasts)
+    c = read_tab(args.baseline_clim).set_index(KEYS)["pred_c"]
+    l = read_tab(args.baseline_lag12).set_index(KEYS)["pred_c"]
 
     # *** WICHTIG: LEFT JOIN auf das Modell, damit KEINE Modellzeilen verloren gehen ***
-    df = (m
-          .merge(c, on=KEYS, how="left")
-          .merge(l, on=KEYS, how="left"))
+    # reindex auf die Modell-Keys = reiner Hash-Lookup je Baseline, Zeilenfolge bleibt die des Modells
+    idx = pd.MultiIndex.from_frame(m[KEYS])
+    df = m.assign(pred_c_clim=c.reindex(idx).to_numpy(), pred_c_lag12=l.reindex(idx).to_numpy())
+    num_cols = [c for c in ["pred_c","truth_c","pred_c_clim","pred_c_lag12"] if c in df.columns]
+    df[num_cols] = df[num_cols].astype(np.float32)
 
     # Beste Baseline pro Zeile (nur, wenn vorhanden); sonst NaN
     if "truth_c" in df.columns:
-        df["ae_clim"]  = (df["pred_c_clim"]  - df["truth_c"]).abs()
-        df["ae_lag12"] = (df["pred_c_lag12"] - df["truth_c"]).abs()
-        df["pred_c_base"] = np.where(
-            df["ae_clim"].notna() & df["ae_lag12"].notna(),
-            np.where(df["ae_clim"] <= df["ae_lag12"], df["pred_c_clim"], df["pred_c_lag12"]),
-            np.where(df["pred_c_clim"].notna(), df["pred_c_clim"], df["pred_c_lag12"])
-        )
+        # (2, N): Zeile 0 = clim, 1 = lag12; argmin des AE (NaN -> inf, Gleichstand -> clim)
+        preds = np.stack([df["pred_c_clim"].to_numpy(), df["pred_c_lag12"].to_numpy()])
+        ae = np.abs(preds - df["truth_c"].to_numpy())
+        idx = np.argmin(np.where(np.isnan(ae), np.inf, ae), axis=0)
+        base = preds[idx, np.arange(preds.shape[1])]
+        # ohne vergleichbaren AE: vorhandene Baseline (clim bevorzugt)
+        df["pred_c_base"] = np.where(np.isnan(base), np.where(np.isnan(preds[0]), preds[1], preds[0]), base)
     else:
         # Fallback ohne truth: nimm vorhandene Baseline (clim bevorzugt)
         df["pred_c_base"] = np.where(df["pred_c_clim"].notna(), df["pred_c_clim"], df["pred_c_lag12"])
 
-    df["bucket"] = df["horizon"].apply(lambda h: bucket_name(int(h), buckets))
+    df["bucket"] = bucket_names(df["horizon"].to_numpy(), buckets)
 
     # Gewichte pro Ziel-Bucket aus RMSE minimieren (nur dort, wo Base vorhanden ist)
-    grid = np.linspace(args.w_min, args.w_max, num=args.grid_steps)
+    # RMSE((1-w)*mm + w*bb) ist quadratisch in w -> Minimum geschlossen: w* = d·r / d·d, auf [w_min, w_max] geclippt
     best_w = {}
     for name in args.buckets_to_opt:
         sub = df[(df["bucket"]==name) & (df["pred_c_base"].notna())]
@@ -64,23 +89,22 @@ def main():
             best_w[name] = 0.0
             continue
         y, mm, bb = sub["truth_c"].values, sub["pred_c"].values, sub["pred_c_base"].values
-        best = (0.0, float("inf"))
-        for w in grid:
-            p = (1.0 - w)*mm + w*bb
-            rmse = float(np.sqrt(np.mean((p - y)**2)))
-            if rmse < best[1]:
-                best = (w, rmse)
-        best_w[name] = best[0]
+        d, r = bb - mm, y - mm
+        num, den = float(np.dot(d, r)), float(np.dot(d, d))
+        # NaN in truth -> keine gültige RMSE, wie bisher Gewicht 0
+        ok = den > 0 and np.isfinite(num) and np.isfinite(den)
+        best_w[name] = float(np.clip(num / den, args.w_min, args.w_max)) if ok else 0.0
 
     # Blend anwenden: nur dort, wo Base vorhanden; sonst bleibt Model-Pred unverändert
-    df["blend_w"] = df["bucket"].map(lambda n: best_w.get(n, 0.0))
+    w_arr = np.array([best_w.get(n, 0.0) for n in df["bucket"].cat.categories], dtype=np.float32)
+    df["blend_w"] = w_arr[df["bucket"].cat.codes.to_numpy()]
     df.loc[df["pred_c_base"].isna(), "blend_w"] = 0.0
     df["pred_c"] = (1.0 - df["blend_w"]) * df["pred_c"] + df["blend_w"] * df["pred_c_base"].fillna(0.0)
 
     # In ursprünglichem Modellschema speichern
     out_cols = list(m.columns)
     Path(args.out_forecasts).parent.mkdir(parents=True, exist_ok=True)
-    df[out_cols].to_csv(args.out_forecasts, index=False)
+    write_tab(df[out_cols], args.out_forecasts)
     print("Optimized weights per bucket:", best_w)
     print("[OK] Blended forecasts written:", args.out_forecasts, "rows=", len(df))
 
@@ -0,0 +1,62 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Phase 4 – Regressionscheck für ridge_cv_rmse (geschlossene alpha-CV) gegen die frühere Schleife
+StandardScaler+Ridge je alpha und Fold. Die Folds enthalten eine konstante Nicht-Null-Spalte mit
+Float-Rauschen, std ~2.4e-15 (wie roll_mean_12 bei Severnaya_Zemlya, cutoff 1932-01).
+Beispiel:
+  python scripts/phase4_check_ridge_cv.py
+"""
+from __future__ import annotations
+import sys
+from pathlib import Path
+import numpy as np
+from sklearn.linear_model import Ridge
+from sklearn.model_selection import TimeSeriesSplit
+from sklearn.pipeline import make_pipeline
+from sklearn.preprocessing import StandardScaler
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+import phase4_train_direct_mid, phase4_train_ridge  # noqa: E402
+
+ALPHAS = [0.1, 0.3, 1.0, 3.0, 10.0, 30.0]
+
+def loop_cv_rmse(X: np.ndarray, y: np.ndarray, alphas: list[float], n_splits: int)->np.ndarray:
+    # die ursprüngliche Auswahl: je alpha und Fold eine eigene Pipeline
+    out = []
+    for a in alphas:
+        r = []
+        for tr, va in TimeSeriesSplit(n_splits=n_splits).split(X):
+            m = make_pipeline(StandardScaler(), Ridge(alpha=a)).fit(X[tr], y[tr])
+            r.append(np.sqrt(np.mean((m.predict(X[va]) - y[va])**2)))
+        out.append(np.mean(r))
+    return np.asarray(out)
+
+def make_case(seed: int, n: int = 120):
+    rng = np.random.default_rng(seed)
+    X = rng.normal(size=(n, 6))
+    # konstant -0.951 im ersten Teil (Rundungsrauschen, std ~2.4e-15), danach variabel
+    const = np.full(n, -0.951) + rng.choice([-1, 0, 1], size=n) * 3e-15
+    const[n//2:] = rng.normal(-0.9, 0.2, size=n - n//2)
+    X = np.column_stack([X, const, np.full(n, 2.5)])
+    y = X[:, :3] @ np.array([0.5, -0.2, 0.1]) + rng.normal(scale=0.3, size=n)
+    return X, y
+
+def main():
+    failed = 0
+    for mod in (phase4_train_direct_mid, phase4_train_ridge):
+        for seed in range(5):
+            X, y = make_case(seed)
+            for n_splits in (2, 3):
+                got = mod.ridge_cv_rmse(X, y, ALPHAS, n_splits)
+                ref = loop_cv_rmse(X, y, ALPHAS, n_splits)
+                ok = np.allclose(got, ref, rtol=1e-8) and np.argmin(got) == np.argmin(ref)
+                if not ok:
+                    failed += 1
+                    print(f"[FAIL] {mod.__name__} seed={seed} n_splits={n_splits}: {got} vs {ref}")
+    if failed:
+        raise SystemExit(f"[FAIL] {failed} case(s) differ from the StandardScaler+Ridge loop")
+    print("[OK] ridge_cv_rmse matches the StandardScaler+Ridge loop (incl. constant columns)")
+
+if __name__ == "__main__":
+    main()
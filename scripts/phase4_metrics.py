@@ -5,12 +5,21 @@ import argparse, json
 from pathlib import Path
 import pandas as pd
 import numpy as np
-
-def bucket_name(h: int, buckets: list[dict])->str:
-    for b in buckets:
-        if b["h_start"] <= h <= b["h_end"]:
-            return b["name"]
-    return "h_na"
+import pyarrow as pa, pyarrow.csv as pcsv
+
+def bucket_names(h, buckets: list[dict])->np.ndarray:
+    # Binärsuche über die sortierten h_start-Grenzen statt linearem Scan je Zeile; Lücken -> "h_na"
+    bs = sorted(buckets, key=lambda b: b["h_start"])
+    starts = np.array([b["h_start"] for b in bs])
+    ends = np.array([b["h_end"] for b in bs])
+    names = np.array([b["name"] for b in bs] + ["h_na"], dtype=object)
+    h = np.asarray(h, dtype=np.int64)
+    idx = np.searchsorted(starts, h, side="right") - 1
+    pos = np.clip(idx, 0, len(bs) - 1)
+    return names[np.where((idx >= 0) & (h <= ends[pos]), idx, len(bs))]
+
+def write_csv(df: pd.DataFrame, path) -> None:
+    pcsv.write_csv(pa.Table.from_pandas(df, preserve_index=False), path)
 
 def main():
     ap = argparse.ArgumentParser(description="Phase 4 – Metrics for model forecasts + comparison to baselines.")
@@ -28,19 +37,23 @@ def main():
         cfg = json.load(f)
     buckets = cfg["buckets"]
 
-    m = pd.read_csv(args.model_forecasts)
-    b1 = pd.read_csv(args.baseline_clim).assign(baseline="climatology")
-    b2 = pd.read_csv(args.baseline_lag12).assign(baseline="lag12")
+    # nur die benötigten Spalten lesen (Projektion im pyarrow-Reader)
+    cols = ["country","horizon","pred_c","truth_c"]
+    m = pd.read_csv(args.model_forecasts, engine="pyarrow", usecols=cols)
+    b1 = pd.read_csv(args.baseline_clim, engine="pyarrow", usecols=cols).assign(baseline="climatology")
+    b2 = pd.read_csv(args.baseline_lag12, engine="pyarrow", usecols=cols).assign(baseline="lag12")
 
     m["ae"] = (m["pred_c"] - m["truth_c"]).abs()
     m["se"] = (m["pred_c"] - m["truth_c"])**2
-    m["bucket"] = m["horizon"].apply(lambda h: bucket_name(int(h), buckets))
+    m["bucket"] = bucket_names(m["horizon"], buckets)
 
+    # nur eingebaute Aggregationen (kein Python-Lambda je Gruppe); RMSE = sqrt(MSE) danach vektorisiert
     by_country = (m.groupby(["country","bucket"])
                     .agg(n=("ae","count"),
                          MAE=("ae","mean"),
-                         RMSE=("se", lambda s: float(np.sqrt(s.mean()))))
+                         RMSE=("se","mean"))
                     .reset_index())
+    by_country["RMSE"] = np.sqrt(by_country["RMSE"])
     by_country["who"] = "model_ridge"
 
     global_m = (by_country.groupby(["who","bucket"])
@@ -52,13 +65,14 @@ def main():
     b = pd.concat([b1,b2], ignore_index=True)
     b["ae"] = (b["pred_c"] - b["truth_c"]).abs()
     b["se"] = (b["pred_c"] - b["truth_c"])**2
-    b["bucket"] = b["horizon"].apply(lambda h: bucket_name(int(h), buckets))
+    b["bucket"] = bucket_names(b["horizon"], buckets)
 
     b_by_country = (b.groupby(["country","baseline","bucket"])
                       .agg(n=("ae","count"),
                            MAE=("ae","mean"),
-                           RMSE=("se", lambda s: float(np.sqrt(s.mean()))))
+                           RMSE=("se","mean"))
                       .reset_index())
+    b_by_country["RMSE"] = np.sqrt(b_by_country["RMSE"])
 
     b_global = (b_by_country.groupby(["baseline","bucket"])
                   .agg(countries=("country","nunique"),
@@ -67,8 +81,8 @@ def main():
                   .reset_index())
 
     Path(args.out_by_country).parent.mkdir(parents=True, exist_ok=True)
-    by_country.to_csv(args.out_by_country, index=False)
-    global_m.to_csv(args.out_global, index=False)
+    write_csv(by_country, args.out_by_country)
+    write_csv(global_m, args.out_global)
 
     # Summary MD
     topline = pd.concat([
@@ -84,13 +98,14 @@ def main():
 
     # Decision MD (wins vs. best baseline)
     model_c = by_country.rename(columns={"MAE":"MAE_model","RMSE":"RMSE_model"})[["country","bucket","MAE_model","RMSE_model"]]
-    best_b = (b_by_country.sort_values(["country","bucket","RMSE"])
-                .groupby(["country","bucket"]).head(1)
+    # beste Baseline je (country, bucket) per idxmin statt Vollsortierung; NaN-RMSE wie beim Sortieren zuletzt
+    best_idx = b_by_country["RMSE"].fillna(np.inf).groupby([b_by_country["country"], b_by_country["bucket"]]).idxmin()
+    best_b = (b_by_country.loc[best_idx]
                 .rename(columns={"baseline":"best_baseline","RMSE":"RMSE_best","MAE":"MAE_best"})
                 [["country","bucket","best_baseline","RMSE_best","MAE_best"]])
     cmp = model_c.merge(best_b, on=["country","bucket"], how="inner")
     cmp["improvement_pct"] = (cmp["RMSE_best"] - cmp["RMSE_model"]) / cmp["RMSE_best"]
-    wins = (cmp.groupby("bucket")["improvement_pct"].apply(lambda s: float((s>0).mean()))).reset_index()
+    wins = cmp["improvement_pct"].gt(0).groupby(cmp["bucket"]).mean().reset_index()
 
     dec = ["# Phase 4 – Decision", "", "## Wins by country (model better than best baseline)", "",
            "| bucket | share_model_better |", "|---|---:|"]
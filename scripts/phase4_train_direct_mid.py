@@ -3,13 +3,17 @@
 from __future__ import annotations
 
 import argparse, json, math
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
 from dataclasses import dataclass
 from pathlib import Path
 import numpy as np
 import pandas as pd
+import pyarrow as pa, pyarrow.compute as pc, pyarrow.csv as pcsv
 from sklearn.linear_model import Ridge
 from sklearn.model_selection import TimeSeriesSplit
 from sklearn.preprocessing import StandardScaler
+from sklearn.pipeline import make_pipeline
 
 @dataclass
 class Cfg:
@@ -23,6 +27,7 @@ class Cfg:
     h_end: int
     alphas: list[float]
     min_train_rows: int
+    workers: int | None
 
 def ym_to_key(y:int, m:int)->int: return y*12 + (m-1)
 def key_to_ym(k:int)->tuple[int,int]: return k//12, (k%12)+1
@@ -43,12 +48,38 @@ def load_cfg(args)->Cfg:
         h_end=int(args.h_end),
         alphas=[float(a) for a in (args.alphas or [10.0, 100.0, 300.0])],
         min_train_rows=int(args.min_train_rows),
+        workers=args.workers,
     )
 
-def build_lookup(anom: pd.DataFrame):
-    a = anom.copy()
-    a["k"] = a["year"].astype(int)*12 + (a["month"].astype(int)-1)
-    return a.set_index(["country","k"]).sort_index()
+def build_arrays(anom: pd.DataFrame)->dict[str, dict]:
+    """
+    Je Land dichte Arrays über k0..kN (Index k-k0): anom/clim/temp, fehlende Monate = NaN,
+    present markiert vorhandene Zeilen. Ersetzt MultiIndex-.loc-Lookups im Hot Path.
+    """
+    a = anom.assign(k=anom["year"].astype(int)*12 + (anom["month"].astype(int)-1))
+    out = {}
+    for c, g in a.groupby("country", sort=False):
+        k = g["k"].to_numpy()
+        k0 = int(k.min()); idx = k - k0
+        n = int(k.max()) - k0 + 1
+        d = {"k0": k0, "present": np.zeros(n, dtype=bool)}
+        d["present"][idx] = True
+        for name, col in (("anom","anomaly_c"), ("clim","clim_temp_c"), ("temp","temp_c")):
+            d[name] = np.full(n, np.nan)
+            d[name][idx] = g[col].to_numpy(dtype=float)
+        out[c] = d
+    return out
+
+def at_k(arr: np.ndarray, k0: int, ks: np.ndarray)->np.ndarray:
+    # Werte an den Monaten ks; außerhalb des Länder-Bereichs -> NaN
+    i = np.asarray(ks) - k0
+    ok = (i >= 0) & (i < len(arr))
+    out = np.full(i.shape, np.nan)
+    out[ok] = arr[i[ok]]
+    return out
+
+NO_DATA = {"k0": 0, "present": np.zeros(0, dtype=bool),
+           "anom": np.zeros(0), "clim": np.zeros(0), "temp": np.zeros(0)}
 
 def select_features(df: pd.DataFrame)->list[str]:
     cols = ["mon_sin","mon_cos","anom_lag1","anom_lag12","roll_mean_3","roll_std_3"]
@@ -56,28 +87,127 @@ def select_features(df: pd.DataFrame)->list[str]:
         if c in df.columns: cols.append(c)
     return cols
 
+def ridge_cv_rmse(X: np.ndarray, y: np.ndarray, alphas: list[float], n_splits: int)->np.ndarray:
+    """
+    Mittlerer Validierungs-RMSE je alpha über TimeSeriesSplit, geschlossen gelöst statt Scaler/Ridge-Objekte:
+    je Fold Standardisierung auf dem Train-Teil, eine Eigenzerlegung der Gram-Matrix, dann
+    beta(alpha) = V diag(1/(lambda+alpha)) V^T X^T (y - y_mean) für alle alphas auf einmal.
+    """
+    al = np.asarray(alphas, dtype=float)
+    rmses = np.zeros((len(al), n_splits))
+    for f, (tr, va) in enumerate(TimeSeriesSplit(n_splits=n_splits).split(X)):
+        mu, var = X[tr].mean(axis=0), X[tr].var(axis=0)
+        # konstante Spalten mit der relativen Schranke von StandardScaler (_is_constant_feature) -> scale 1
+        n, eps = len(tr), np.finfo(np.float64).eps
+        sd = np.sqrt(var)
+        sd[var <= n*eps*var + (n*mu*eps)**2] = 1.0
+        Xtr, Xva = (X[tr] - mu) / sd, (X[va] - mu) / sd
+        y_mean = y[tr].mean()
+        lam, V = np.linalg.eigh(Xtr.T @ Xtr)
+        B = V @ ((V.T @ (Xtr.T @ (y[tr] - y_mean)))[:, None] / (lam[:, None] + al))
+        err = Xva @ B + y_mean - y[va][:, None]
+        rmses[:, f] = np.sqrt(np.mean(err**2, axis=0))
+    return rmses.mean(axis=1)
+
 def fit_ridge_timeaware(X: np.ndarray, y: np.ndarray, alphas: list[float]):
+    # Pipeline statt _scaler-Attribut; alpha-CV in geschlossener Form (ridge_cv_rmse), nur der finale Fit über sklearn
     if X.shape[0] < 60:
-        s = StandardScaler().fit(X)
-        m = Ridge(alpha=alphas[0]).fit(s.transform(X), y)
-        m._scaler, m._alpha = s, alphas[0]
-        return m
+        return make_pipeline(StandardScaler(), Ridge(alpha=alphas[0])).fit(X, y)
     n_splits = 3 if X.shape[0] >= 100 else 2
-    tscv = TimeSeriesSplit(n_splits=n_splits)
-    best = (alphas[0], float("inf"))
-    for a in alphas:
-        rmses=[]
-        for tr,va in tscv.split(X):
-            s = StandardScaler().fit(X[tr])
-            m = Ridge(alpha=a).fit(s.transform(X[tr]), y[tr])
-            pred = m.predict(s.transform(X[va]))
-            rmses.append(float(np.sqrt(np.mean((pred - y[va])**2))))
-        avg = float(np.mean(rmses))
-        if avg < best[1]: best = (a, avg)
-    s = StandardScaler().fit(X)
-    m = Ridge(alpha=best[0]).fit(s.transform(X), y)
-    m._scaler, m._alpha = s, best[0]
-    return m
+    best = alphas[int(np.argmin(ridge_cv_rmse(X, y, alphas, n_splits)))]
+    return make_pipeline(StandardScaler(), Ridge(alpha=best)).fit(X, y)
+
+def write_csv(df: pd.DataFrame, path) -> None:
+    pcsv.write_csv(pa.Table.from_pandas(df, preserve_index=False), path)
+
+def linear_form(model, col_idx: np.ndarray, p: int):
+    """
+    Pipeline(StandardScaler, Ridge) als lineare Abbildung im Original-Featureraum (p Spalten):
+    pred = x @ w + b, mit w = coef/scale auf col_idx (sonst 0) und b = intercept - (mean/scale) @ coef.
+    used markiert die Spalten des Modells.
+    """
+    sc, rg = model[0], model[-1]
+    w = np.zeros(p); w[col_idx] = rg.coef_ / sc.scale_
+    used = np.zeros(p, dtype=bool); used[col_idx] = True
+    return w, float(rg.intercept_ - (sc.mean_ / sc.scale_) @ rg.coef_), used
+
+def alloc_out(n: int)->dict[str, np.ndarray]:
+    # typisierte Spaltenpuffer für die Prognosezeilen (statt list[dict] + DataFrame(rows))
+    return {"country": np.empty(n, dtype=object), "year": np.empty(n, dtype=np.int64),
+            "month": np.empty(n, dtype=np.int64), "cutoff_ym": np.empty(n, dtype=object),
+            "horizon": np.empty(n, dtype=np.int64), "pred_anom": np.empty(n), "pred_c": np.empty(n),
+            "truth_c": np.empty(n)}
+
+def forecast_country(country, arrays, P: dict, *, cut_keys, cut_yms, cols: list[str], hs: range, cfg: Cfg):
+    """
+    Direkte Prognosen h in hs für alle Cutoffs eines Landes; nur NumPy-Eingaben
+    (arrays = k, X, nan_cum; P = dichte Anomalie-Arrays), damit je Land ein eigener Prozess-Job.
+    Rückgabe: Spaltenpuffer der Prognosezeilen.
+    """
+    k_arr, X_full, nan_cum = arrays
+    out = alloc_out(len(cut_keys) * len(hs))
+    n_out = 0
+    fit_cache = {}  # (country, h, cols, letzter Train-Monat, Zeilen) -> Modell; identische Trainingsmengen nicht neu fitten
+    for k_cut, cutoff_ym in zip(cut_keys, cut_yms):
+        # predictor row at k = k_cut (features are already lagged/seasonal), shared by all h
+        i_cut = int(np.searchsorted(k_arr, k_cut))
+        has_xrow = i_cut < len(k_arr) and k_arr[i_cut] == k_cut
+        if not has_xrow:
+            continue
+        # je h nur Fit + Koeffizienten sammeln; Vorhersage danach für alle h in einem GEMV
+        pend_h, pend_w, pend_b, pend_used, pend_clim, pend_truth = [], [], [], [], [], []
+        for h in hs:
+            # TRAIN: only rows with k <= k_cut - h (so that target at k+h exists after cutoff)
+            n_tr = int(np.searchsorted(k_arr, k_cut - h, side="right"))
+            if n_tr < max(cfg.min_train_rows, 1):
+                continue
+
+            # dynamic feature selection per country/cutoff (no NaN columns)
+            col_idx = np.flatnonzero(~nan_cum[n_tr-1])
+            if not len(col_idx):
+                continue
+            use_cols = [cols[c] for c in col_idx]
+
+            # build direct target: anomaly at k+h (fehlende Monate -> NaN)
+            y = at_k(P["anom"], P["k0"], k_arr[:n_tr] + h)
+            keep = ~np.isnan(y)
+            if keep.sum() < cfg.min_train_rows:
+                continue
+
+            # columns come from nan_cum and y is masked by keep, so X/y are NaN-free without another scan
+            X = X_full[:n_tr][keep][:, col_idx]
+            y = y[keep]
+
+            key = (country, h, tuple(use_cols), int(k_arr[:n_tr][keep][-1]), len(y))
+            lin = fit_cache.get(key)
+            if lin is None:
+                lin = fit_cache[key] = linear_form(fit_ridge_timeaware(X, y, cfg.alphas), col_idx, len(cols))
+
+            # PREDICT at the single origin k_cut for horizon h (nur wenn Zielmonat vorhanden)
+            i_tgt = k_cut + h - P["k0"]
+            if not (0 <= i_tgt < len(P["present"])) or not P["present"][i_tgt]:
+                continue
+            pend_h.append(h); pend_w.append(lin[0]); pend_b.append(lin[1]); pend_used.append(lin[2])
+            pend_clim.append(P["clim"][i_tgt]); pend_truth.append(P["temp"][i_tgt])
+
+        if not pend_h:
+            continue
+        # gleiche Prädiktorzeile für alle h: preds = W @ x + b; h mit NaN in eigenen Spalten entfallen
+        x = X_full[i_cut]
+        x_nan = np.isnan(x)
+        ok = ~(np.vstack(pend_used) & x_nan).any(axis=1)
+        preds = np.vstack(pend_w) @ np.where(x_nan, 0.0, x) + np.array(pend_b)
+        for j in np.flatnonzero(ok):
+            h = pend_h[j]
+            y_tgt, m_tgt = key_to_ym(k_cut + h)
+            pred_anom = float(preds[j])
+            out["country"][n_out] = country; out["year"][n_out] = y_tgt; out["month"][n_out] = m_tgt
+            out["cutoff_ym"][n_out] = cutoff_ym; out["horizon"][n_out] = h
+            out["pred_anom"][n_out] = pred_anom; out["pred_c"][n_out] = pred_anom + float(pend_clim[j])
+            out["truth_c"][n_out] = float(pend_truth[j])
+            n_out += 1
+
+    return {c: v[:n_out] for c, v in out.items()}
 
 def main():
     ap = argparse.ArgumentParser(description="Direct mid-horizon training (replace h7..24) and merge into existing forecasts.")
@@ -91,6 +221,7 @@ def main():
     ap.add_argument("--h_end", type=int, default=24)
     ap.add_argument("--alphas", nargs="*", type=float, default=[30.0,100.0,300.0])
     ap.add_argument("--min_train_rows", type=int, default=120)
+    ap.add_argument("--workers", type=int, default=None, help="worker processes for the per-country fits (default: all cores)")
     args = ap.parse_args()
     cfg = load_cfg(args)
 
@@ -103,99 +234,49 @@ def main():
 
     # keys
     feat["k"] = feat["year"].astype(int)*12 + (feat["month"].astype(int)-1)
-    A = build_lookup(anom)
+    A = build_arrays(anom)
 
     # ensure cutoff_key
     if "cutoff_key" not in cuts.columns:
-        def parse_ym(s:str)->int:
-            y,m = s.split("-"); return ym_to_key(int(y), int(m))
-        cuts = cuts.copy()
-        cuts["cutoff_key"] = cuts["cutoff_ym"].apply(parse_ym)
+        # "YYYY-MM" spaltenweise zerlegen statt parse_ym je Zeile
+        ym = cuts["cutoff_ym"].str.split("-", expand=True).astype(int)
+        cuts = cuts.assign(cutoff_key=ym_to_key(ym[0].to_numpy(), ym[1].to_numpy()))
 
     # select usable feature columns (global superset)
     base_cols = select_features(feat)
 
-    rows = []
-    for _, crow in cuts.iterrows():
-        k_cut = int(crow["cutoff_key"])
-        cutoff_ym = str(crow.get("cutoff_ym",""))
-
-        for country, dfc in feat.groupby("country"):
-            dfc = dfc.sort_values("k")
-            # Precompute truth/clim per horizon h for fast access
-            for h in range(cfg.h_start, min(cfg.h_end, HMAX)+1):
-                # TRAIN: only rows with k <= k_cut - h (so that target at k+h exists after cutoff)
-                train = dfc[dfc["k"] <= (k_cut - h)].copy()
-                if len(train) < cfg.min_train_rows:
-                    continue
-
-                # dynamic feature selection per country/cutoff (no NaN columns)
-                use_cols = [c for c in base_cols if c in train.columns and not train[c].isna().any()]
-                if not use_cols:
-                    continue
-
-                # build direct target: anomaly at k+h
-                def targ_at(k):
-                    try:
-                        return float(A.loc[(country, int(k+h)), "anomaly_c"])
-                    except KeyError:
-                        return np.nan
-                train["y_target"] = train["k"].apply(targ_at)
-                train = train.dropna(subset=["y_target"])
-                if len(train) < cfg.min_train_rows:
-                    continue
-
-                X = train[use_cols].values
-                y = train["y_target"].values
-                if np.isnan(X).any() or np.isnan(y).any():
-                    continue
-
-                model = fit_ridge_timeaware(X, y, cfg.alphas)
-
-                # PREDICT at the single origin k_cut for horizon h
-                k_tgt = k_cut + h
-                y_tgt, m_tgt = key_to_ym(k_tgt)
-                try:
-                    clim = float(A.loc[(country, k_tgt), "clim_temp_c"])
-                    truth_c = float(A.loc[(country, k_tgt), "temp_c"])
-                except KeyError:
-                    continue
-
-                # construct predictor row for that single (country, cutoff, h)
-                # We reuse features from dfc at k = k_cut (features are already lagged/seasonal)
-                xrow = dfc[dfc["k"] == k_cut]
-                if xrow.empty:
-                    continue
-                x = xrow.iloc[0:1][use_cols].copy()
-                if x.isna().any(axis=None):
-                    continue
-
-                x_s = model._scaler.transform(x.values)
-                pred_anom = float(model.predict(x_s)[0])
-                pred_c = pred_anom + clim
-
-                rows.append({
-                    "country": country,
-                    "year": int(y_tgt),
-                    "month": int(m_tgt),
-                    "cutoff_ym": cutoff_ym,
-                    "horizon": int(h),
-                    "pred_anom": pred_anom,
-                    "pred_c": pred_c,
-                    "truth_c": truth_c,
-                    "model": "ridge_direct"
-                })
+    # einmal je Land: nach k sortierte Arrays (statt groupby + Frame-Kopien in jeder Cutoff-Iteration)
+    groups = {}
+    for country, dfc in feat.groupby("country"):
+        dfc = dfc.sort_values("k")
+        X_full = dfc[base_cols].to_numpy(dtype=float)
+        # kumulierte NaN-Maske: Zeile j sagt, welche Spalten in X_full[:j+1] schon ein NaN hatten
+        groups[country] = (dfc["k"].to_numpy(), X_full, np.logical_or.accumulate(np.isnan(X_full), axis=0))
+
+    hs = range(cfg.h_start, min(cfg.h_end, HMAX)+1)
+    # Länder unabhängig -> ein Prozess-Job je Land über alle Cutoffs
+    countries = list(groups)
+    job = partial(forecast_country,
+                  cut_keys=cuts["cutoff_key"].astype(int).tolist(),
+                  cut_yms=[str(v) for v in cuts["cutoff_ym"]] if "cutoff_ym" in cuts.columns else [""] * len(cuts),
+                  cols=base_cols, hs=hs, cfg=cfg)
+    with ProcessPoolExecutor(max_workers=cfg.workers) as ex:
+        parts = list(ex.map(job, countries, [groups[c] for c in countries], [A.get(c, NO_DATA) for c in countries]))
+    parts = parts or [alloc_out(0)]
 
     # assemble direct mid-horizon frame
-    mid = pd.DataFrame(rows)
-    # merge into existing forecasts: replace only h in [h_start, h_end]
-    base = pd.read_csv(cfg.in_forecasts)
-    keycols = ["country","year","month","cutoff_ym","horizon"]
+    mid = pd.DataFrame({c: np.concatenate([o[c] for o in parts]) for c in parts[0]}).assign(model="ridge_direct")
+    # merge into existing forecasts: replace only h in [h_start, h_end] (Arrow-Tabellen, kein pandas-Merge)
+    base = pcsv.read_csv(cfg.in_forecasts, convert_options=pcsv.ConvertOptions(
+        column_types={"country": pa.string(), "cutoff_ym": pa.string()}))
     # drop old mid-range
-    keep = base[(base["horizon"] < cfg.h_start) | (base["horizon"] > cfg.h_end)].copy()
-    merged = pd.concat([keep, mid], ignore_index=True).sort_values(keycols)
+    hz = base.column("horizon")
+    keep = base.filter(pc.or_(pc.less(hz, cfg.h_start), pc.greater(hz, cfg.h_end)))
+    merged = pa.concat_tables([keep, pa.Table.from_pandas(mid, preserve_index=False)], promote_options="permissive")
+    # Sortierung nach (country, year, month, cutoff_ym, horizon): stabiler Arrow-Sort, fehlende Werte ans Ende
+    order = pc.sort_indices(merged, sort_keys=[(c, "ascending") for c in ["country","year","month","cutoff_ym","horizon"]])
     Path(cfg.out_forecasts).parent.mkdir(parents=True, exist_ok=True)
-    merged.to_csv(cfg.out_forecasts, index=False)
+    pcsv.write_csv(merged.take(order), cfg.out_forecasts)
     print(f"[OK] Wrote merged forecasts to {cfg.out_forecasts} "
           f"(replaced horizons {cfg.h_start}..{cfg.h_end})")
 
@@ -2,14 +2,18 @@
 # -*- coding: utf-8 -*-
 from __future__ import annotations
 
-import argparse, json, math
+import argparse, json
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
 from pathlib import Path
 from dataclasses import dataclass
 import pandas as pd
 import numpy as np
+import pyarrow as pa, pyarrow.csv as pcsv
 from sklearn.preprocessing import StandardScaler
 from sklearn.linear_model import Ridge
 from sklearn.model_selection import TimeSeriesSplit
+from sklearn.pipeline import make_pipeline
 
 @dataclass
 class Config:
@@ -25,6 +29,10 @@ class Config:
     blend_start: int
     blend_end: int
     blend_max: float
+    workers: int | None
+
+# Kandidaten-Features der Rekursion (Obermenge von select_features)
+REC_FEATURES = ["mon_sin","mon_cos","anom_lag1","anom_lag12","roll_mean_3","roll_std_3","anom_lag24","roll_mean_12"]
 
 def ym_to_key(y:int,m:int)->int: return y*12 + (m-1)
 def key_to_ym(k:int)->tuple[int,int]: return k//12, (k%12)+1
@@ -46,12 +54,50 @@ def load_cfg(args)->Config:
         blend_start=int(args.blend_start),
         blend_end=int(args.blend_end),
         blend_max=float(args.blend_max),
+        workers=args.workers,
     )
 
-def build_lookup(df: pd.DataFrame):
-    d = df.copy()
-    d["k"] = d["year"].astype(int)*12 + (d["month"].astype(int)-1)
-    return d.set_index(["country","k"]).sort_index()
+def build_arrays(anom: pd.DataFrame)->dict[str, dict]:
+    """
+    Je Land dichte Arrays über k0..kN (Index k-k0): anom/clim/temp, fehlende Monate = NaN,
+    present markiert vorhandene Zeilen. Ersetzt MultiIndex-.loc-Lookups im Hot Path.
+    """
+    a = anom.assign(k=anom["year"].astype(int)*12 + (anom["month"].astype(int)-1))
+    out = {}
+    for c, g in a.groupby("country", sort=False):
+        k = g["k"].to_numpy()
+        k0 = int(k.min()); idx = k - k0
+        n = int(k.max()) - k0 + 1
+        d = {"k0": k0, "present": np.zeros(n, dtype=bool)}
+        d["present"][idx] = True
+        for name, col in (("anom","anomaly_c"), ("clim","clim_temp_c"), ("temp","temp_c")):
+            d[name] = np.full(n, np.nan)
+            d[name][idx] = g[col].to_numpy(dtype=float)
+        out[c] = d
+    return out
+
+def at_k(arr: np.ndarray, k0: int, ks: np.ndarray)->np.ndarray:
+    # Werte an den Monaten ks; außerhalb des Länder-Bereichs -> NaN
+    i = np.asarray(ks) - k0
+    ok = (i >= 0) & (i < len(arr))
+    out = np.full(i.shape, np.nan)
+    out[ok] = arr[i[ok]]
+    return out
+
+NO_DATA = {"k0": 0, "present": np.zeros(0, dtype=bool),
+           "anom": np.zeros(0), "clim": np.zeros(0), "temp": np.zeros(0)}
+
+def ffill_bfill(a: np.ndarray)->np.ndarray:
+    # wie Series.ffill().bfill(): Index des letzten gültigen Werts per maximum.accumulate, Rand vorne mit erstem Wert
+    valid = ~np.isnan(a)
+    if valid.all() or not valid.any():
+        return a
+    idx = np.where(valid, np.arange(len(a)), 0)
+    np.maximum.accumulate(idx, out=idx)
+    out = a[idx]
+    first = int(np.argmax(valid))
+    out[:first] = a[first]
+    return out
 
 def select_features(df: pd.DataFrame)->list[str]:
     cols = ["mon_sin","mon_cos","anom_lag1","anom_lag12","roll_mean_3","roll_std_3"]
@@ -59,33 +105,45 @@ def select_features(df: pd.DataFrame)->list[str]:
         if c in df.columns: cols.append(c)
     return cols
 
+def ridge_cv_rmse(X: np.ndarray, y: np.ndarray, alphas: list[float], n_splits: int)->np.ndarray:
+    """
+    Mittlerer Validierungs-RMSE je alpha über TimeSeriesSplit, geschlossen gelöst statt Scaler/Ridge-Objekte:
+    je Fold Standardisierung auf dem Train-Teil, eine Eigenzerlegung der Gram-Matrix, dann
+    beta(alpha) = V diag(1/(lambda+alpha)) V^T X^T (y - y_mean) für alle alphas auf einmal.
+    """
+    al = np.asarray(alphas, dtype=float)
+    rmses = np.zeros((len(al), n_splits))
+    for f, (tr, va) in enumerate(TimeSeriesSplit(n_splits=n_splits).split(X)):
+        mu, var = X[tr].mean(axis=0), X[tr].var(axis=0)
+        # konstante Spalten mit der relativen Schranke von StandardScaler (_is_constant_feature) -> scale 1
+        n, eps = len(tr), np.finfo(np.float64).eps
+        sd = np.sqrt(var)
+        sd[var <= n*eps*var + (n*mu*eps)**2] = 1.0
+        Xtr, Xva = (X[tr] - mu) / sd, (X[va] - mu) / sd
+        y_mean = y[tr].mean()
+        lam, V = np.linalg.eigh(Xtr.T @ Xtr)
+        B = V @ ((V.T @ (Xtr.T @ (y[tr] - y_mean)))[:, None] / (lam[:, None] + al))
+        err = Xva @ B + y_mean - y[va][:, None]
+        rmses[:, f] = np.sqrt(np.mean(err**2, axis=0))
+    return rmses.mean(axis=1)
+
 def fit_ridge_timeaware(X: np.ndarray, y: np.ndarray, alphas: list[float]):
+    """
+    Scaler+Ridge als Pipeline; alpha per TimeSeriesSplit-CV (geschlossen, siehe ridge_cv_rmse),
+    sklearn nur für den finalen Fit. Kurze Serien: alpha=1.0 ohne CV.
+    """
     if X.shape[0] < 60:
-        scaler = StandardScaler().fit(X)
-        m = Ridge(alpha=1.0).fit(scaler.transform(X), y)
-        m._scaler = scaler
-        m._alpha = 1.0
-        return m
+        return make_pipeline(StandardScaler(), Ridge(alpha=1.0)).fit(X, y)
     n_splits = 3 if X.shape[0] >= 100 else 2
-    tscv = TimeSeriesSplit(n_splits=n_splits)
-    best_alpha, best_rmse = None, float("inf")
-    for a in alphas:
-        rmses = []
-        for tr, va in tscv.split(X):
-            s = StandardScaler().fit(X[tr])
-            Xtr, Xva = s.transform(X[tr]), s.transform(X[va])
-            m = Ridge(alpha=a).fit(Xtr, y[tr])
-            pred = m.predict(Xva)
-            rmse = float(np.sqrt(np.mean((pred - y[va])**2)))
-            rmses.append(rmse)
-        avg = float(np.mean(rmses))
-        if avg < best_rmse:
-            best_rmse, best_alpha = avg, a
-    scaler = StandardScaler().fit(X)
-    model = Ridge(alpha=best_alpha).fit(scaler.transform(X), y)
-    model._scaler = scaler
-    model._alpha = best_alpha
-    return model
+    best_alpha = alphas[int(np.argmin(ridge_cv_rmse(X, y, alphas, n_splits)))]
+    return make_pipeline(StandardScaler(), Ridge(alpha=best_alpha)).fit(X, y)
+
+def alloc_out(n: int)->dict[str, np.ndarray]:
+    # typisierte Spaltenpuffer für die Prognosezeilen (statt list[dict] + DataFrame(rows))
+    return {"country": np.empty(n, dtype=object), "year": np.empty(n, dtype=np.int64),
+            "month": np.empty(n, dtype=np.int64), "cutoff_ym": np.empty(n, dtype=object),
+            "horizon": np.empty(n, dtype=np.int64), "pred_anom": np.empty(n), "pred_c": np.empty(n),
+            "truth_c": np.empty(n)}
 
 def blend_weight(h:int, start:int, end:int, wmax:float)->float:
     if end <= start or wmax <= 0: return 0.0
@@ -94,6 +152,107 @@ def blend_weight(h:int, start:int, end:int, wmax:float)->float:
     # linear ramp
     return wmax * (h - start) / float(end - start)
 
+def write_csv(df: pd.DataFrame, path) -> None:
+    pcsv.write_csv(pa.Table.from_pandas(df, preserve_index=False), path)
+
+def forecast_country(country, arrays, P: dict, fb, *, cut_keys, cut_yms, cols: list[str], hmax: int, cfg: Config):
+    """
+    Alle Cutoffs eines Landes: Fit + rekursive Prognose 1..hmax. Arbeitet nur auf NumPy-Arrays
+    (arrays = k, X, y, nan_cum; P = dichte Anomalie-Arrays; fb = Monats-Klimatologie oder None),
+    damit die Länder unabhängig in eigenen Prozessen laufen können.
+    Rückgabe: Spaltenpuffer der Prognosezeilen + Cutoff-Index je Zeile.
+    """
+    k_arr, X_full, y_full, nan_cum = arrays
+    out = alloc_out(len(cut_keys) * hmax)
+    cut = np.empty(len(cut_keys) * hmax, dtype=np.int64)
+    n_out = 0
+    # gleiche Trainingsmenge (Spalten, letzter Train-Monat, Zeilen) -> gleiches Modell, kein Refit
+    fit_cache = {}
+    damp = max(0.0, min(1.0, cfg.damping))
+    for ci, (k_cut, cutoff_ym) in enumerate(zip(cut_keys, cut_yms)):
+        n_tr = int(np.searchsorted(k_arr, k_cut, side="right"))
+        if n_tr < max(cfg.min_train_rows, 1):
+            continue
+
+        # Nur vollständige Spalten im jeweiligen Train-Set
+        col_idx = np.flatnonzero(~nan_cum[n_tr-1])
+        if not len(col_idx):
+            continue
+        use_cols = [cols[c] for c in col_idx]
+
+        keep = ~np.isnan(y_full[:n_tr])
+        if keep.sum() < cfg.min_train_rows:
+            continue
+
+        # NaN-frei per Konstruktion: col_idx aus nan_cum, y über keep gefiltert -> kein Scan mehr nötig
+        X = X_full[:n_tr][keep][:, col_idx]
+        y = y_full[:n_tr][keep]
+
+        key = (country, tuple(use_cols), int(k_arr[:n_tr][keep][-1]), len(y))
+        model = fit_cache.get(key)
+        if model is None:
+            model = fit_cache[key] = fit_ridge_timeaware(X, y, cfg.alphas)
+        # Skalierung + Ridge inline in der Rekursion (ohne sklearn-Validierung je Schritt)
+        mu, sd = model[0].mean_, model[0].scale_
+        coef, icpt = model[-1].coef_, float(model[-1].intercept_)
+
+        # Historie (Anomalien) bis Cutoff für Rekursion
+        hist = at_k(P["anom"], P["k0"], np.arange(k_cut-59, k_cut+1))
+        # vorallokierter Puffer: 60 Monate Historie + hmax rekursive Werte; n = Füllstand, hist[-k] = buf[n-k]
+        buf = np.empty(60 + hmax)
+        buf[:60] = ffill_bfill(hist)
+        n = 60
+        sel = np.array([REC_FEATURES.index(c) for c in use_cols])
+        cand = np.empty(len(REC_FEATURES))
+        k_tgts = k_cut + np.arange(1, hmax+1)
+        ang = 2*np.pi*((k_tgts % 12) + 1)/12.0
+        mon_sin_arr, mon_cos_arr = np.sin(ang), np.cos(ang)
+
+        for h in range(1, hmax+1):
+            k_tgt = k_cut + h
+            y_tgt, m_tgt = key_to_ym(k_tgt)
+            # --- robust climatology + optional truth (Zukunft erlaubt) ---
+            # 1) Climatology: Zeile (country, k_tgt) vorhanden -> deren Wert, sonst Monatsmittel als Fallback
+            # 2) Truth ist für Zukunft nicht vorhanden -> NaN
+            i_tgt = k_tgt - P["k0"]
+            if 0 <= i_tgt < len(P["present"]) and P["present"][i_tgt]:
+                clim = float(P["clim"][i_tgt])
+                truth_c = float(P["temp"][i_tgt])
+            else:
+                clim = float(fb[m_tgt]) if fb is not None else np.nan
+                truth_c = np.nan
+
+            # Feature-Vektor aus State (Reihenfolge REC_FEATURES, dann Auswahl use_cols);
+            # NaN in einem Fenster -> NaN im Mittel/Std -> Abbruch wie zuvor
+            w3, w12 = buf[n-3:n], buf[n-12:n]
+            cand[:] = (mon_sin_arr[h-1], mon_cos_arr[h-1], buf[n-1], buf[n-12],
+                       w3.mean(), w3.std(), buf[n-24], w12.mean())
+            x_vec = cand[sel]
+            if np.isnan(x_vec).any():
+                break
+
+            pred_anom = float(((x_vec - mu) / sd) @ coef + icpt)
+
+            # Optional: Clip der Anomalie
+            if cfg.clip_anom > 0:
+                pred_anom = float(np.clip(pred_anom, -cfg.clip_anom, cfg.clip_anom))
+
+            # Climatology-Blend (auf °C)
+            w = blend_weight(h, cfg.blend_start, cfg.blend_end, cfg.blend_max)
+            pred_c = clim + (1.0 - w) * pred_anom
+
+            out["country"][n_out] = country; out["year"][n_out] = y_tgt; out["month"][n_out] = m_tgt
+            out["cutoff_ym"][n_out] = cutoff_ym; out["horizon"][n_out] = h
+            out["pred_anom"][n_out] = pred_anom; out["pred_c"][n_out] = pred_c; out["truth_c"][n_out] = truth_c
+            cut[n_out] = ci
+            n_out += 1
+
+            # Rekursives Update mit Dämpfung (Mean-Reversion Richtung 0)
+            buf[n] = damp * pred_anom
+            n += 1
+
+    return {c: v[:n_out] for c, v in out.items()}, cut[:n_out]
+
 def main():
     ap = argparse.ArgumentParser(description="Phase 4 – Ridge per country, rolling-origin, recursive 1..HMAX with damping & climatology blend.")
     ap.add_argument("--features", required=True, help="features/features_v1.csv")
@@ -109,6 +268,7 @@ def main():
     ap.add_argument("--blend_start", type=int, default=0, help="Horizon where climatology blending starts (0=off).")
     ap.add_argument("--blend_end", type=int, default=0, help="Horizon where blending reaches max.")
     ap.add_argument("--blend_max", type=float, default=0.0, help="Max blend weight with climatology at blend_end (0..1).")
+    ap.add_argument("--workers", type=int, default=None, help="Worker processes for the per-country fits (default: all cores).")
     args = ap.parse_args()
     cfg = load_cfg(args)
 
@@ -120,120 +280,45 @@ def main():
     HMAX = int(setup["horizons_max"])
 
     feat["k"] = feat["year"].astype(int)*12 + (feat["month"].astype(int)-1)
-    anom["k"] = anom["year"].astype(int)*12 + (anom["month"].astype(int)-1)
-    L = build_lookup(anom)
+    A = build_arrays(anom)
+    # Fallback-Klimatologie je (country, month): Monatsmittel von clim_temp_c, Index = Monat (1..12)
+    clm = anom.groupby(["country","month"])["clim_temp_c"].mean()
+    clm_month = {}
+    for (c, m), v in clm.items():
+        clm_month.setdefault(str(c).strip(), np.full(13, np.nan))[int(m)] = v
 
     if "cutoff_key" not in cuts.columns:
-        def parse_ym(s: str)->int:
-            y, m = s.split("-"); return ym_to_key(int(y), int(m))
-        cuts = cuts.copy(); cuts["cutoff_key"] = cuts["cutoff_ym"].apply(parse_ym)
+        # "YYYY-MM" spaltenweise zerlegen statt parse_ym je Zeile
+        ym = cuts["cutoff_ym"].str.split("-", expand=True).astype(int)
+        cuts = cuts.assign(cutoff_key=ym_to_key(ym[0].to_numpy(), ym[1].to_numpy()))
 
-    rows = []
     base_feature_list = select_features(feat)
 
-    for _, crow in cuts.iterrows():
-        k_cut = int(crow["cutoff_key"]); cutoff_ym = str(crow.get("cutoff_ym", ""))
-        for country, dfc in feat.groupby("country"):
-            dfc = dfc.sort_values("k")
-            train = dfc[dfc["k"] <= k_cut].copy()
-            if len(train) < cfg.min_train_rows:
-                continue
-
-            # Nur vollständige Spalten im jeweiligen Train-Set
-            use_cols = [c for c in base_feature_list if c in train.columns and not train[c].isna().any()]
-            if not use_cols:
-                continue
-
-            train = train.dropna(subset=["target_anom_t_plus_1"])
-            if len(train) < cfg.min_train_rows:
-                continue
-
-            X = train[use_cols].values
-            y = train["target_anom_t_plus_1"].values
-            if np.isnan(X).any() or np.isnan(y).any():
-                continue
-
-            model = fit_ridge_timeaware(X, y, cfg.alphas)
-
-            # Historie (Anomalien) bis Cutoff für Rekursion
-            hist = []
-            for kk in range(k_cut-59, k_cut+1):
-                try: hist.append(float(L.loc[(country, kk), "anomaly_c"]))
-                except KeyError: hist.append(np.nan)
-            s = pd.Series(hist).fillna(method="ffill").fillna(method="bfill")
-            hist = list(s.values)
-
-            for h in range(1, HMAX+1):
-                k_tgt = k_cut + h
-                y_tgt, m_tgt = key_to_ym(k_tgt)
-                # --- robust climatology + optional truth (Zukunft erlaubt) ---
-                # 1) Climatology ermitteln: erst Lookup L, sonst Monatsmittel als Fallback
-                try:
-                    clim = float(L.loc[(country, k_tgt), "clim_temp_c"])
-                except KeyError:
-                    # Monatsmittel pro Land/Monat aus Historie als Fallback
-                    if "CLM_MAP" not in globals():
-                        # einmalig aufbauen: mean(clim_temp_c) je (country, month)
-                        _clm = anom.groupby(["country", "month"], as_index=False)["clim_temp_c"].mean()
-                        globals()["CLM_MAP"] = {(str(r["country"]).strip(), int(r["month"])): float(r["clim_temp_c"])
-                                                for _, r in _clm.iterrows()}
-                    clim = float(globals()["CLM_MAP"].get((country, m_tgt), np.nan))
-
-                # 2) Truth ist für Zukunft nicht vorhanden -> optional/NaN
-                try:
-                    truth_c = float(L.loc[(country, k_tgt), "temp_c"])
-                except KeyError:
-                    truth_c = np.nan
-
-                # Feature-Vektor aus State
-                mon_sin = math.sin(2*math.pi*m_tgt/12.0)
-                mon_cos = math.cos(2*math.pi*m_tgt/12.0)
-                anom_lag1 = hist[-1] if len(hist)>=1 else np.nan
-                anom_lag12 = hist[-12] if len(hist)>=12 else np.nan
-                last3 = [v for v in hist[-3:] if pd.notna(v)]
-                roll_mean_3 = float(np.mean(last3)) if len(last3)==3 else np.nan
-                roll_std_3  = float(np.std(last3, ddof=0)) if len(last3)==3 else np.nan
-                last12 = [v for v in hist[-12:] if pd.notna(v)]
-                roll_mean_12 = float(np.mean(last12)) if len(last12)==12 else np.nan
-
-                x = {"mon_sin":mon_sin, "mon_cos":mon_cos,
-                     "anom_lag1":anom_lag1, "anom_lag12":anom_lag12,
-                     "roll_mean_3":roll_mean_3, "roll_std_3":roll_std_3}
-                if "anom_lag24" in use_cols:
-                    x["anom_lag24"] = (hist[-24] if len(hist)>=24 else np.nan)
-                if "roll_mean_12" in use_cols:
-                    x["roll_mean_12"] = roll_mean_12
-
-                x_df = pd.DataFrame([x])[use_cols]
-                if x_df.isna().any(axis=None):
-                    break
-
-                x_s = model._scaler.transform(x_df.values)
-                pred_anom = float(model.predict(x_s)[0])
-
-                # Optional: Clip der Anomalie
-                if cfg.clip_anom > 0:
-                    pred_anom = float(np.clip(pred_anom, -cfg.clip_anom, cfg.clip_anom))
-
-                # Climatology-Blend (auf °C)
-                w = blend_weight(h, cfg.blend_start, cfg.blend_end, cfg.blend_max)
-                pred_c = clim + (1.0 - w) * pred_anom
-
-                rows.append({
-                    "country": country, "year": int(y_tgt), "month": int(m_tgt),
-                    "cutoff_ym": cutoff_ym, "horizon": int(h),
-                    "pred_anom": pred_anom, "pred_c": pred_c, "truth_c": truth_c,
-                    "model": "ridge"
-                })
-
-                # Rekursives Update mit Dämpfung (Mean-Reversion Richtung 0)
-                damp = max(0.0, min(1.0, cfg.damping))
-                hist.append(damp * pred_anom)
-                if len(hist) > 120:
-                    hist = hist[-120:]
+    # einmal je Land: nach k sortierte Arrays (statt groupby + Frame-Kopie je Cutoff)
+    groups = {}
+    for country, dfc in feat.groupby("country"):
+        dfc = dfc.sort_values("k")
+        X_full = dfc[base_feature_list].to_numpy(dtype=float)
+        # nan_cum[j, c]: Spalte c hat bis einschließlich Zeile j schon ein NaN -> use_cols je Cutoff ist ein Lookup
+        groups[country] = (dfc["k"].to_numpy(), X_full, dfc["target_anom_t_plus_1"].to_numpy(dtype=float),
+                           np.logical_or.accumulate(np.isnan(X_full), axis=0))
+
+    # Länder sind unabhängig -> je Land ein Prozess-Job über alle Cutoffs
+    countries = list(groups)
+    job = partial(forecast_country,
+                  cut_keys=cuts["cutoff_key"].astype(int).tolist(),
+                  cut_yms=[str(v) for v in cuts["cutoff_ym"]] if "cutoff_ym" in cuts.columns else [""] * len(cuts),
+                  cols=base_feature_list, hmax=HMAX, cfg=cfg)
+    with ProcessPoolExecutor(max_workers=cfg.workers) as ex:
+        parts = list(ex.map(job, countries, [groups[c] for c in countries],
+                            [A.get(c, NO_DATA) for c in countries], [clm_month.get(c) for c in countries]))
+    parts = parts or [(alloc_out(0), np.empty(0, dtype=np.int64))]
+    # Zeilenfolge wie bisher: Cutoff, dann Land (Teile kommen in Länder-Reihenfolge -> stabiler Sort)
+    order = np.argsort(np.concatenate([ci for _, ci in parts]), kind="stable")
 
     Path(cfg.out_forecasts).parent.mkdir(parents=True, exist_ok=True)
-    pd.DataFrame(rows).to_csv(cfg.out_forecasts, index=False)
+    fc = pd.DataFrame({c: np.concatenate([o[c] for o, _ in parts])[order] for c in parts[0][0]}).assign(model="ridge")
+    write_csv(fc, cfg.out_forecasts)
     print("[OK] Forecasts written:", cfg.out_forecasts)
 
 if __name__ == "__main__":
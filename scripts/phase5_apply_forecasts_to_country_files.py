@@ -15,17 +15,24 @@ import argparse
 from pathlib import Path
 import pandas as pd
 import numpy as np
+import pyarrow as pa, pyarrow.compute as pc, pyarrow.csv as pcsv
 
 REQ = ["country","year","month","cutoff_ym","horizon","pred_c"]
 
 def norm(s:str)->str: return str(s).strip()
-def ym_key(y:int,m:int)->int: return int(y)*12 + (int(m)-1)
-def key_to_ym(k:int)->tuple[int,int]: return k//12, (k%12)+1
-def midmonth(y:int,m:int)->str: return f"{int(y):04d}-{int(m):02d}-15"
+# Schlüssel-Helfer arbeiten auf ganzen Arrays (keine Zeilen-apply)
+def ym_key(y, m)->np.ndarray: return np.asarray(y, dtype=np.int64)*12 + (np.asarray(m, dtype=np.int64)-1)
+def key_to_ym(k)->tuple[np.ndarray,np.ndarray]: return k//12, (k%12)+1
+def midmonth(y, m)->np.ndarray:
+    return (pd.Series(y).astype(str).str.zfill(4) + "-" + pd.Series(m).astype(str).str.zfill(2) + "-15").to_numpy()
 
-def latest_cutoff(df: pd.DataFrame)->str:
-    def k(s): y,m = s.split("-"); return int(y)*12 + int(m) - 1
-    return sorted(df["cutoff_ym"].unique(), key=k)[-1]
+def latest_cutoff(cutoffs: pd.Series)->str:
+    u = pd.Series(pd.unique(cutoffs))
+    ym = u.str.split("-", expand=True).astype(int)
+    return u.iloc[int(np.argmax(ym_key(ym[0], ym[1])))]
+
+def write_csv(df: pd.DataFrame, path) -> None:
+    pcsv.write_csv(pa.Table.from_pandas(df, preserve_index=False), path)
 
 def main():
     ap = argparse.ArgumentParser(description="Append next 60 months per country after the last date in each file.")
@@ -39,26 +46,29 @@ def main():
     cdir = Path(args.country_dir)
     outdir = Path(args.out_dir); outdir.mkdir(parents=True, exist_ok=True)
 
-    F = pd.read_csv(args.forecasts)
-    miss = [c for c in REQ if c not in F.columns]
+    # Projektion + Filter im Arrow-Reader: nur REQ-Spalten, nach pandas nur Zeilen des letzten Cutoffs
+    with pcsv.open_csv(args.forecasts) as r:  # nur der Header, Reader danach wieder zu
+        have = r.schema.names
+    miss = [c for c in REQ if c not in have]
     if miss:
         raise ValueError(f"Forecasts missing columns: {miss}")
-
-    # normalize forecasts
-    F["country"] = F["country"].map(norm)
-    F["year"]    = F["year"].astype(int)
-    F["month"]   = F["month"].astype(int)
+    T = pcsv.read_csv(args.forecasts, convert_options=pcsv.ConvertOptions(
+        include_columns=REQ, column_types={"country": pa.string(), "cutoff_ym": pa.string()}))
 
     # use latest cutoff, horizons 1..60 (falls dein File >60 Horizonte enthält, ist das ok)
-    lc = latest_cutoff(F)
-    F = F[F["cutoff_ym"] == lc].copy()
+    lc = latest_cutoff(T.column("cutoff_ym").unique().to_pandas())
+    F = T.filter(pc.equal(T.column("cutoff_ym"), lc)).to_pandas()
     if F.empty:
         raise ValueError("No rows at latest cutoff in forecasts.")
-    F["k"] = F.apply(lambda r: ym_key(r["year"], r["month"]), axis=1)
 
-    F_idx = F.set_index(["country","k"]).sort_index()
+    # normalize forecasts
+    F["country"] = F["country"].map(norm)
+    F["year"]    = F["year"].astype(int)
+    F["month"]   = F["month"].astype(int)
+    F["k"] = ym_key(F["year"], F["month"])
 
-    total_added = 0
+    # alle Länderdateien einmal einlesen; Schlüssel/Joins danach in einem Durchgang
+    files = []
     for p in sorted(cdir.glob("*.csv")):
         try:
             df = pd.read_csv(p)
@@ -70,66 +80,64 @@ def main():
             print(f"[WARN] {p.name}: unexpected schema; skipping.")
             continue
 
-        file_country = norm(df["country"].iloc[0]) if not df.empty else p.stem
-        # last existing (y,m) in this country file
-        if df.empty:
-            last_k = -1
-        else:
+        if not df.empty:
             df["year"] = df["year"].astype(int)
             df["month"] = df["month"].astype(int)
-            last_k = int(df.apply(lambda r: ym_key(r["year"], r["month"]), axis=1).max())
+        files.append((p, df))
+
+    # last existing (y,m) per file: one maximum.at over the concatenated keys (-1 for empty files)
+    n_files = len(files)
+    src = np.repeat(np.arange(n_files), [len(df) for _, df in files])
+    keys = np.concatenate([ym_key(df["year"], df["month"]) for _, df in files] + [np.empty(0, np.int64)])
+    last_k = np.full(n_files, -1, dtype=np.int64)
+    np.maximum.at(last_k, src, keys)
+    meta = pd.DataFrame({
+        "_src": np.arange(n_files),
+        "country": [norm(df["country"].iloc[0]) if not df.empty else p.stem for p, df in files],
+        "last_k": last_k,
+    })
+
+    # ein Merge Datei x Prognosen, dann je Datei die nächsten 60 Monate nach last_k
+    cand = meta.merge(F[["country","k","pred_c"]], on="country", how="inner")
+    cand = (cand[cand["k"] > cand["last_k"]]
+            .sort_values(["_src","k"], kind="stable")
+            .groupby("_src", sort=False).head(60))
+    y, m = key_to_ym(cand["k"].to_numpy(dtype=np.int64))
+    add_all = pd.DataFrame({
+        "date":   midmonth(y, m),
+        "year":   y,
+        "month":  m,
+        "temp_c": cand["pred_c"].to_numpy(dtype=float),
+        "country": cand["country"].to_numpy(),
+    })
+    # Zeilen je Datei liegen zusammenhängend (nach _src sortiert) -> Grenzen per searchsorted
+    add_src = cand["_src"].to_numpy()
+    bounds = np.searchsorted(add_src, np.arange(n_files + 1))
+    have_fc = set(F["country"].unique())
 
-        # get all forecast months strictly after last_k
-        try:
-            sub = F_idx.loc[file_country]
-            if isinstance(sub, pd.Series):
-                sub = sub.to_frame().T
-        except KeyError:
+    total_added = 0
+    for i, (p, df) in enumerate(files):
+        file_country = meta.at[i, "country"]
+        if file_country not in have_fc:
             print(f"[INFO] {p.name}: no forecasts for country='{file_country}' at cutoff {lc}")
-            sub = pd.DataFrame(columns=F_idx.columns)
 
-        if sub.empty:
+        add = add_all.iloc[bounds[i]:bounds[i+1]]
+        if add.empty:
             added = 0
             out = df
         else:
-            sub = sub.reset_index()  # has columns: k, pred_c
-            sub = sub[sub["k"] > last_k].sort_values("k")
-
-            # optional: if we only want the next 60 calendar months, take head(60)
-            sub = sub.head(60).copy()
-
-            if sub.empty:
-                added = 0
-                out = df
-            else:
-                # build target rows
-                rows = []
-                for _, r in sub.iterrows():
-                    y, m = key_to_ym(int(r["k"]))
-                    rows.append({
-                        "date":   midmonth(y,m),
-                        "year":   int(y),
-                        "month":  int(m),
-                        "temp_c": float(r["pred_c"]),
-                        "country": file_country
-                    })
-                add = pd.DataFrame(rows)
-
-                if args.allow_overwrite:
-                    # drop existing (y,m) to replace with forecast
-                    idx_existing = set(zip(df["year"].astype(int), df["month"].astype(int)))
-                    idx_add = set(zip(add["year"], add["month"]))
-                    to_drop = list(idx_existing & idx_add)
-                    if to_drop:
-                        mask = ~df.set_index(["year","month"]).index.isin(to_drop)
-                        df = df[mask].reset_index(drop=True)
-
-                out = pd.concat([df, add], ignore_index=True)
-                added = len(add)
-
-        out.to_csv(outdir / p.name, index=False)
+            if args.allow_overwrite and not df.empty:
+                # drop existing (y,m) to replace with forecast
+                keep = ~np.isin(ym_key(df["year"], df["month"]), ym_key(add["year"], add["month"]))
+                if not keep.all():
+                    df = df[keep].reset_index(drop=True)
+
+            out = pd.concat([df, add], ignore_index=True)
+            added = len(add)
+
+        write_csv(out, outdir / p.name)
         total_added += added
-        print(f"[OK] {p.name}: last_k={last_k} +{added} rows (cutoff {lc})")
+        print(f"[OK] {p.name}: last_k={int(last_k[i])} +{added} rows (cutoff {lc})")
 
     print(f"[DONE] total added rows: {total_added}")
 
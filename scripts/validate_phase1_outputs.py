@@ -3,19 +3,64 @@
 from __future__ import annotations
 
 import argparse, json
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 import pandas as pd
 import numpy as np
-from datetime import datetime
+import pyarrow as pa, pyarrow.compute as pc, pyarrow.csv as pcsv, pyarrow.parquet as pq
+from datetime import datetime, timezone
 
-def load_any(path: Path) -> pd.DataFrame:
+def load_any(path: Path, columns: list[str] | None = None) -> pd.DataFrame:
+    # pyarrow-Reader mit Projektion: nur die gewünschten (und vorhandenen) Spalten werden dekodiert
     sfx = path.suffix.lower()
     if sfx == ".csv":
-        return pd.read_csv(path)
+        if columns is not None:
+            with pcsv.open_csv(path) as r:  # nur der Header, Reader danach wieder zu
+                have = r.schema.names
+            columns = [c for c in columns if c in have]
+        return pd.read_csv(path, engine="pyarrow", usecols=columns)
     if sfx == ".parquet":
-        return pd.read_parquet(path)
+        if columns is not None:
+            have = pq.read_schema(path).names
+            columns = [c for c in columns if c in have]
+        # memory_map: Seiten direkt aus der gemappten Datei, Spalten parallel dekodiert
+        return pq.read_table(path, columns=columns, memory_map=True, use_threads=True).to_pandas()
     raise ValueError(f"Unsupported file: {path}")
 
+def count_by_country(path: Path, batch_rows: int = 1 << 16) -> pd.Series:
+    """
+    Zeilen je country, gestreamt über Arrow-Batches (nur die country-Spalte):
+    Speicher O(Batch) statt O(Datei), weil monthly_clean nur für die Zählung gebraucht wird.
+    """
+    sfx = path.suffix.lower()
+    if sfx == ".parquet":
+        batches = pq.ParquetFile(path).iter_batches(batch_size=batch_rows, columns=["country"])
+    elif sfx == ".csv":
+        batches = pcsv.open_csv(path, read_options=pcsv.ReadOptions(block_size=batch_rows * 64),
+                                convert_options=pcsv.ConvertOptions(include_columns=["country"],
+                                                                    column_types={"country": pa.string()}))
+    else:
+        raise ValueError(f"Unsupported file: {path}")
+    totals: dict[str, int] = {}
+    for b in batches:
+        vc = pc.value_counts(b.column(0))
+        for k, n in zip(vc.field("values").to_pylist(), vc.field("counts").to_pylist()):
+            if k is not None:
+                totals[k] = totals.get(k, 0) + n
+    return pd.Series(totals, name="clean_rows", dtype=np.int64)
+
+def write_csv(df: pd.DataFrame, path) -> None:
+    pcsv.write_csv(pa.Table.from_pandas(df, preserve_index=False), path)
+
+def _shrink(df: pd.DataFrame) -> pd.DataFrame:
+    # schmale dtypes (wie ensure_cols in compute_climatology_anomalies): weniger Bandbreite für groupby/mean
+    if "month" in df.columns: df["month"] = df["month"].astype(np.int8)
+    if "year" in df.columns: df["year"] = df["year"].astype(np.int16)
+    if "anomaly_c" in df.columns: df["anomaly_c"] = df["anomaly_c"].astype(np.float32)
+    for c in ("ref_start","ref_end"):
+        if c in df.columns: df[c] = df[c].astype("Int16")  # nullable: fehlendes Fenster bleibt <NA>
+    return df
+
 def main():
     ap = argparse.ArgumentParser(description="Phase 1 – Step 10: Validate final outputs and basic consistency.")
     ap.add_argument("--monthly_clean", required=False, help="data_clean/monthly_clean.(csv|parquet) with outlier flags")
@@ -28,78 +73,114 @@ def main():
     ap.add_argument("--report_json", required=True, help="Output JSON with global summary")
     args = ap.parse_args()
 
-    # Load required files
-    clim = load_any(Path(args.climatology))
-    anom = load_any(Path(args.anomalies))
+    # Load required files: die Leser sind unabhängig und geben beim Dekodieren in pyarrow das GIL frei -> parallel
+    # Optional files: reference_periods / outliers_summary / sanity_persistence werden nur als Pfad im JSON vermerkt, nicht gelesen
+    with ThreadPoolExecutor(max_workers=3) as ex:
+        f_clim = ex.submit(lambda: _shrink(load_any(Path(args.climatology), ["country","month","ref_start","ref_end"])))
+        f_anom = ex.submit(lambda: _shrink(load_any(Path(args.anomalies), ["country","year","month","anomaly_c"])))
+        f_clean = (ex.submit(count_by_country, Path(args.monthly_clean))
+                   if args.monthly_clean and Path(args.monthly_clean).exists() else None)
+        clim, anom = f_clim.result(), f_anom.result()
+        clean_counts = f_clean.result() if f_clean is not None else None
 
-    # Optional files
-    ref_df = pd.read_csv(args.reference_periods) if args.reference_periods and Path(args.reference_periods).exists() else None
-    outliers_df = pd.read_csv(args.outliers_summary) if args.outliers_summary and Path(args.outliers_summary).exists() else None
-    sp_df = pd.read_csv(args.sanity_persistence) if args.sanity_persistence and Path(args.sanity_persistence).exists() else None
-    clean_df = load_any(Path(args.monthly_clean)) if args.monthly_clean and Path(args.monthly_clean).exists() else None
+    # country einmal als Categorical mit gemeinsamen (sortierten) Kategorien -> groupby/merge über int-Codes
+    cats = pd.CategoricalDtype(pd.Index(pd.concat([pd.Series(f["country"].unique()) for f in (clim, anom)])).dropna().unique().sort_values())
+    for f in (clim, anom):
+        f["country"] = f["country"].astype(cats)
 
     # Checks per country
-    # 1) climatology has 12 rows per country
-    c12 = clim.groupby("country")["month"].nunique().rename("clim_unique_months")
-    # extract ref window per country from climatology if present
-    if "ref_start" in clim.columns and "ref_end" in clim.columns:
-        ref_info = clim.groupby("country")[["ref_start","ref_end"]].first()
+    # 1) climatology has 12 rows per country: Monatspräsenz als bincount über code*12 + (month-1) statt nunique
+    has_ref = "ref_start" in clim.columns and "ref_end" in clim.columns
+    n_cat = len(cats.categories)
+    cc = clim["country"].cat.codes.to_numpy(np.int64)
+    mm = clim["month"].to_numpy(np.int64)
+    known = cc >= 0
+    in_range = known & (mm >= 1) & (mm <= 12)
+    present = np.bincount(cc[in_range]*12 + (mm[in_range] - 1), minlength=n_cat*12).reshape(n_cat, 12) > 0
+    uniq = present.sum(axis=1)
+    odd = known & ~in_range
+    if odd.any():  # Monate außerhalb 1..12 zählen wie bei nunique als eigene Werte mit
+        pairs = np.unique(np.stack([cc[odd], mm[odd]]), axis=1)
+        uniq = uniq + np.bincount(pairs[0], minlength=n_cat)
+    clim_agg = pd.DataFrame({"clim_unique_months": uniq},
+                            index=pd.CategoricalIndex(cats.categories, dtype=cats, name="country"))
+    clim_agg = clim_agg[np.bincount(cc[known], minlength=n_cat) > 0]
+    # ref window per country from climatology if present
+    if has_ref:
+        clim_agg = clim_agg.join(clim.groupby("country", sort=False, observed=True)[["ref_start","ref_end"]].first())
     else:
-        ref_info = pd.DataFrame(index=c12.index)
-        ref_info["ref_start"] = np.nan
-        ref_info["ref_end"] = np.nan
+        clim_agg["ref_start"] = np.nan
+        clim_agg["ref_end"] = np.nan
+    ref_info = clim_agg[["ref_start","ref_end"]]
 
     # 2) anomalies rowcount per country (and mean≈0 inside ref window if ref info available)
-    anom_counts = anom.groupby("country").size().rename("anomaly_rows")
-    # join for per-country frame
-    per_country = pd.concat([c12, anom_counts], axis=1)
-    per_country = per_country.merge(ref_info, left_index=True, right_index=True, how="left").reset_index().rename(columns={"index":"country"})
+    # reine Zeilenzählung: bincount über die Kategorien-Codes statt groupby().size()
+    codes = anom["country"].cat.codes.to_numpy()
+    n_rows = np.bincount(codes[codes >= 0], minlength=n_cat)
+    anom_agg = pd.DataFrame({"anomaly_rows": n_rows},
+                            index=pd.CategoricalIndex(cats.categories, dtype=cats, name="country"))[n_rows > 0]
+    # per-country frame: ein Index-Join auf country (Ergebnis nach country sortiert)
+    per_country = clim_agg.join(anom_agg, how="outer")[["clim_unique_months","anomaly_rows","ref_start","ref_end"]]
 
     # mean≈0 within reference period by (country, month)
-    def mean_zero_within_ref(anom: pd.DataFrame, clim: pd.DataFrame):
-        if "ref_start" in clim.columns and "ref_end" in clim.columns:
-            # build lookup per country
-            ref_map = clim.groupby("country")[["ref_start","ref_end"]].first().to_dict(orient="index")
-            flags = []
-            for country, g in anom.groupby("country"):
-                ref = ref_map.get(country, None)
-                if not ref or pd.isna(ref["ref_start"]) or pd.isna(ref["ref_end"]):
-                    flags.append({"country": country, "mean_anom_in_ref_ok": np.nan})
-                    continue
-                y0, y1 = int(ref["ref_start"]), int(ref["ref_end"])
-                within = g[(g["year"]>=y0)&(g["year"]<=y1)]
-                # per-month means
-                pm = within.groupby("month")["anomaly_c"].mean()
-                # accept if all months have |mean| < 0.15°C (tolerance)
-                ok = bool((pm.abs() < 0.15).all()) if len(pm)==12 else False
-                flags.append({"country": country, "mean_anom_in_ref_ok": ok})
-            return pd.DataFrame(flags)
+    def mean_zero_within_ref(anom: pd.DataFrame, ref: pd.DataFrame | None):
+        if ref is not None:
+            # Referenzfenster (aus clim_agg) je Kategorien-Code, per Gather an jede Zeile; Maske direkt auf ndarrays
+            cats = anom["country"].cat.categories
+            r = ref.reindex(pd.CategoricalIndex(cats, dtype=anom["country"].dtype))
+            r0 = r["ref_start"].to_numpy(np.float64, na_value=np.nan)
+            r1 = r["ref_end"].to_numpy(np.float64, na_value=np.nan)
+            codes = anom["country"].cat.codes.to_numpy(np.int64)
+            c = np.where(codes >= 0, codes, 0)
+            years = anom["year"].to_numpy()
+            mask = np.logical_and(years >= r0[c], years <= r1[c], out=np.empty(len(years), dtype=bool))
+            mask &= codes >= 0  # NaN-Fenster vergleicht ohnehin False
+            codes = codes[mask]
+            month = anom["month"].to_numpy(np.int64)[mask]
+            vals = anom["anomaly_c"].to_numpy(np.float64)[mask]
+            # Monatsmittel je (country, month) als ein bincount über code*12 + (month-1), ohne groupby
+            in_range = (month >= 1) & (month <= 12)
+            bad = np.bincount(codes[~in_range], minlength=len(cats)) > 0  # Monat außerhalb 1..12
+            use = in_range & ~np.isnan(vals)
+            key = codes[use]*12 + (month[use] - 1)
+            n = np.bincount(key, minlength=len(cats)*12)
+            with np.errstate(invalid="ignore", divide="ignore"):
+                pm = (np.bincount(key, weights=vals[use], minlength=len(cats)*12) / n).reshape(len(cats), 12)
+            # accept if all 12 months have |mean| < 0.15°C (tolerance); fehlender Monat -> NaN -> nicht ok
+            ok_c = ((np.abs(pm) < 0.15).all(axis=1) & ~bad).astype(object)
+            # kein (vollständiges) Fenster -> NaN statt False; Maske direkt aus den Referenz-Arrays
+            ok_c[np.isnan(r0) | np.isnan(r1)] = np.nan
+            return pd.Series(ok_c, index=cats, name="mean_anom_in_ref_ok").reindex(pd.Index(anom["country"].dropna().unique()))
         else:
-            return pd.DataFrame({"country": anom["country"].unique(), "mean_anom_in_ref_ok": np.nan})
+            return pd.Series(np.nan, index=pd.Index(anom["country"].dropna().unique()), name="mean_anom_in_ref_ok")
 
-    ref_ok = mean_zero_within_ref(anom, clim)
-    per_country = per_country.merge(ref_ok, on="country", how="left")
+    ref_ok = mean_zero_within_ref(anom, ref_info if has_ref else None)
+    per_country = per_country.join(ref_ok, how="left")
 
     # 3) equality of anomalies rows vs monthly_clean rows (if available)
-    if clean_df is not None:
-        clean_counts = clean_df.groupby("country").size().rename("clean_rows")
-        per_country = per_country.merge(clean_counts, left_on="country", right_index=True, how="left")
-        per_country["rows_match_clean"] = per_country["clean_rows"].notna() & (per_country["clean_rows"] == per_country["anomaly_rows"])
+    if clean_counts is not None:
+        # nullable Int32 auf beiden Seiten: ein Vergleich, fehlende Zählung -> <NA> -> False
+        per_country["clean_rows"] = pd.array(clean_counts.reindex(per_country.index.astype(object)).to_numpy(), dtype="Int32")
+        per_country["anomaly_rows"] = per_country["anomaly_rows"].astype("Int32")
+        per_country["rows_match_clean"] = (per_country["clean_rows"] == per_country["anomaly_rows"]).fillna(False)
     else:
         per_country["clean_rows"] = np.nan
         per_country["rows_match_clean"] = np.nan
 
     # Pass/Fail flags
     per_country["climatology_12_months_ok"] = per_country["clim_unique_months"] == 12
+    per_country = per_country.rename_axis("country").reset_index()
 
     # Write CSV
     out_csv = Path(args.report_csv)
     out_csv.parent.mkdir(parents=True, exist_ok=True)
-    per_country.to_csv(out_csv, index=False)
+    write_csv(per_country, out_csv)
 
     # Global summary
+    # alle drei Anteile in einem Durchgang; NaN zählt wie bisher als "nicht ok" (Nenner = alle Länder)
+    shares = per_country[["climatology_12_months_ok","rows_match_clean","mean_anom_in_ref_ok"]].eq(True).mean()
     meta = {
-        "timestamp": datetime.utcnow().isoformat() + "Z",
+        "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds").replace("+00:00", "Z"),
         "climatology_file": args.climatology,
         "anomalies_file": args.anomalies,
         "monthly_clean_file": args.monthly_clean if args.monthly_clean else None,
@@ -107,9 +188,9 @@ def main():
         "outliers_summary_file": args.outliers_summary if args.outliers_summary else None,
         "sanity_persistence_file": args.sanity_persistence if args.sanity_persistence else None,
         "countries": int(per_country["country"].nunique()),
-        "share_climatology_12_ok": float((per_country["climatology_12_months_ok"]==True).mean()),
-        "share_rows_match_clean": float((per_country["rows_match_clean"]==True).mean()) if "rows_match_clean" in per_country else None,
-        "share_mean_anom_ref_ok": float((per_country["mean_anom_in_ref_ok"]==True).mean()) if "mean_anom_in_ref_ok" in per_country else None
+        "share_climatology_12_ok": float(shares["climatology_12_months_ok"]),
+        "share_rows_match_clean": float(shares["rows_match_clean"]),
+        "share_mean_anom_ref_ok": float(shares["mean_anom_in_ref_ok"])
     }
     out_json = Path(args.report_json)
     with open(out_json, "w", encoding="utf-8") as f:
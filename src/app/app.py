@@ -1,84 +1,30 @@
+import base64
 import json
+import re
+import urllib.request
 from pathlib import Path
+import numpy as np
 import pandas as pd
 import streamlit as st
 from streamlit.components.v1 import html
 
+try:  # optional: faster serialization of the float-heavy payload
+    import orjson
+    def dumps(obj) -> str:
+        return orjson.dumps(obj, option=orjson.OPT_SERIALIZE_NUMPY).decode()
+except ImportError:
+    def dumps(obj) -> str:
+        return json.dumps(obj)
+
 DATA_CSV = Path("src/data/temperature/temp_per_country/yearly_temp_aggregated/country_year.csv")
+GEOJSON_URL = "https://raw.githubusercontent.com/nvkelso/natural-earth-vector/master/geojson/ne_110m_admin_0_countries.geojson"
 ANOM_CLIP = (-3.0, 3.0)
+# values ship as little-endian int16 in 1/100 °C; MISSING marks an empty (year, country) cell
+VALUE_SCALE = 100
+VALUE_MISSING = -32768
+PAYLOAD_VERSION = 4
 
-BLOG_HTML = """
-<h1 style="margin: 0 0 8px 0;">What is ClimateWiz?</h1>
-<p style="margin: 0 0 12px 0;">
-  ClimateWiz is an interactive globe that lets you explore how countries have warmed over time.
-  It visualizes either <b>temperature anomalies</b> (change relative to a 1901–2029 baseline)
-  or <b>absolute annual temperatures</b>.
-</p>
-<h2 style="margin: 16px 0 6px 0;">How to read the colors</h2>
-<ul style="margin: 0 0 12px 18px;">
-  <li><b>Blue → White → Red</b>: cooler to warmer along the selected scale.</li>
-  <li>
-    In <b>Anomaly</b> mode, red means the selected year is warmer than that country’s
-    1901–2029 average; blue means cooler.
-  </li>
-  <li>In <b>Absolute</b> mode, colors map to actual °C (cold to hot climates).</li>
-</ul>
-<h2 style="margin: 16px 0 6px 0;">Two metrics, two stories</h2>
-<ul style="margin: 0 0 12px 18px;">
-  <li><b>Anomaly (ΔT)</b>: best for seeing <i>change</i> within each country over time.</li>
-  <li><b>Absolute (°C)</b>: best for communicating the <i>climate people experience</i> (intuitive values in °C).</li>
-</ul>
-<h2 style="margin: 16px 0 6px 0;">How to use it</h2>
-<ol style="margin: 0 0 12px 18px;">
-  <li>Pick <b>Anomaly</b> or <b>Absolute</b> at the top-right.</li>
-  <li>Drag the <b>year slider</b> to travel through time.</li>
-  <li><b>Hover</b> a country to see its value for the selected year.</li>
-  <li>Open the <b>Guide</b> (top-left) for context and notes during your exploration.</li>
-</ol>
-<h2 style="margin: 16px 0 6px 0;">Interpreting the data</h2>
-<ul style="margin: 0 0 12px 18px;">
-  <li><b>Long-term warming</b> appears as a shift toward reds in anomaly mode across successive years.</li>
-  <li>
-    <b>Year-to-year wiggles</b> reflect natural variability; the trend over decades tells the climate story.
-  </li>
-  <li><b>Regional contrasts</b> highlight uneven warming—e.g., high latitudes often warm faster.</li>
-</ul>
-<h2 style="margin: 16px 0 6px 0;">What’s a temperature anomaly?</h2>
-<p style="margin: 0 0 12px 0;">
-  A temperature anomaly is the difference between the selected year’s average temperature and the country’s
-  <b>1901–2029</b> average. <b>ΔT &gt; 0</b> means warmer than that baseline; <b>ΔT &lt; 0</b> means cooler.
-  This makes trends comparable across climates.
-</p>
-<h2 style="margin: 16px 0 6px 0;">How projections are shown</h2>
-<ul style="margin: 0 0 12px 18px;">
-  <li>The globe and charts include values beyond the last observed year when available as <b>projections</b>.</li>
-  <li>In the mini trend chart, the historical line is <b>white</b> and the projection segment is <b>yellow</b>.</li>
-  <li>The year slider starts at the latest observed year (2024) but you can move into the projection years.</li>
-</ul>
-<h2 style="margin: 16px 0 6px 0;">Methodology (short)</h2>
-<ul style="margin: 0 0 12px 18px;">
-  <li>Source: CRU TS v4.09 (country-aggregated annual means) with appended projections where available.</li>
-  <li>Anomalies: year minus each country’s 1901–2029 mean.</li>
-  <li>Aggregation: monthly to annual means; countries require sufficient monthly coverage.</li>
-  <li>Country names are harmonized; small territories may be excluded.</li>
-</ul>
-<h2 style="margin: 16px 0 6px 0;">Limitations</h2>
-<ul style="margin: 0 0 12px 18px;">
-  <li>Not all territories have complete records; some small islands or disputed regions may be missing.</li>
-  <li>Country averages hide sub-national extremes; local conditions can differ.</li>
-  <li>Absolute °C values depend on elevation, latitude, and observational coverage.</li>
-</ul>
-<h2 style="margin: 16px 0 6px 0;">Things to explore</h2>
-<ul style="margin: 0 0 12px 18px;">
-  <li>Compare early 20th century vs. recent decades in anomaly mode.</li>
-  <li>Identify the fastest-warming regions and discuss likely drivers.</li>
-  <li>Switch to absolute °C to relate climate zones to lived experience.</li>
-</ul>
-<p style="margin: 16px 0 0 0; color: #bbb; font-size: 12px;">
-  Tip: Use anomaly mode for trend detection; use absolute °C for intuitive communication.
-</p>
-"""
-BLOG_JSON = json.dumps(BLOG_HTML)
+BLOG_PATH = Path(__file__).with_name("blog.html")  # static asset next to the app
 
 st.set_page_config(page_title="ClimateWiz", page_icon="🌍", layout="wide", initial_sidebar_state="collapsed")
 st.markdown("""
@@ -108,33 +54,93 @@ st.markdown("""
 </style>
 """, unsafe_allow_html=True)
 
-@st.cache_data(show_spinner=False)
-def load_payload(csv_path: Path, mtime: float) -> dict:
-    df = pd.read_csv(csv_path)
-    req = {"country", "year", "temp_c", "base", "anom"}
-    missing = req - set(df.columns)
+def grid_b64(grid: np.ndarray) -> str:
+    # (n_years, n_countries) row-major, cell = value * VALUE_SCALE
+    q = np.rint(grid * VALUE_SCALE)
+    q = np.where(np.isnan(q), VALUE_MISSING, np.clip(q, VALUE_MISSING + 1, 32767)).astype("<i2")
+    return base64.b64encode(q.tobytes()).decode("ascii")
+
+def trend_per_country(grid: np.ndarray) -> list[list[float]]:
+    # least squares over the year index for all countries at once, NaN years left out;
+    # fewer than two points -> slope 0, intercept = the single value (or 0)
+    ok = ~np.isnan(grid)
+    x = np.arange(grid.shape[0], dtype=np.float64)[:, None] * ok
+    y = np.where(ok, grid, 0.0)
+    n = ok.sum(axis=0)
+    sx, sy, sxx, sxy = x.sum(axis=0), y.sum(axis=0), (x * x).sum(axis=0), (x * y).sum(axis=0)
+    denom = n * sxx - sx * sx
+    denom[denom == 0] = 1e-9
+    slope = np.where(n >= 2, (n * sxy - sx * sy) / denom, 0.0)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        intercept = np.where(n >= 2, (sy - slope * sx) / n, sy)
+    return np.round(np.stack([slope, intercept], axis=1), 6).tolist()
+
+def build_payload(csv_path: Path) -> dict:
+    # only the columns the payload uses ("base" is not), with fixed dtypes -> no inference pass
+    req = {"country", "year", "temp_c", "anom"}
+    missing = req - set(pd.read_csv(csv_path, nrows=0).columns)
     if missing:
         raise ValueError(f"Missing columns in {csv_path}: {missing}")
+    df = pd.read_csv(csv_path, usecols=sorted(req), engine="pyarrow",
+                     dtype={"country": str, "year": "Int32", "temp_c": "float32", "anom": "float32"})
     df["country_norm"] = (df["country"].astype(str).str.replace("_", " ", regex=False).str.strip())
     years = sorted(df["year"].dropna().astype(int).unique().tolist())
     years_str = [str(y) for y in years]
-    values_anom, values_abs = {}, {}
-    for y in years:
-        sub = df[df["year"] == y]
-        values_anom[str(y)] = {c: float(v) for c, v in zip(sub["country_norm"], sub["anom"].round(3))}
-        values_abs[str(y)] = {c: float(v) for c, v in zip(sub["country_norm"], sub["temp_c"].round(2))}
+    wide = df.dropna(subset=["year"]).astype({"year": int}).drop_duplicates(["year", "country_norm"], keep="last")
+    countries = sorted(wide["country_norm"].unique().tolist())
+    grids = {m: wide.pivot(index="year", columns="country_norm", values=col)
+                    .reindex(index=years, columns=countries).to_numpy(np.float64)
+             for m, col in (("anom", "anom"), ("abs", "temp_c"))}
     q1, q99 = df["temp_c"].quantile([0.01, 0.99]).tolist()
     abs_clip = (float(round(q1, 1)), float(round(q99, 1)))
     return {
+        "version": PAYLOAD_VERSION,
         "years": years_str,
-        "values": {"anom": values_anom, "abs": values_abs},
+        "countries": countries,
+        "scale": VALUE_SCALE,
+        "values": {m: grid_b64(g) for m, g in grids.items()},
+        "trend": {m: trend_per_country(g) for m, g in grids.items()},
         "clips": {"anom": ANOM_CLIP, "abs": abs_clip},
         "units": {"anom": "Relative Temperature Deviation ΔT (°C)", "abs": "Temperature (°C)"},
-        "default_metric": "anom"
+        "default_metric": "anom",
+        "geo_url": GEOJSON_URL,
     }
 
+@st.cache_data(show_spinner=False)
+def load_payload(csv_path: Path, mtime: float) -> dict:
+    # sidecar next to the CSV; valid as long as it is not older than the CSV
+    cache_path = csv_path.with_suffix(".payload.json")
+    if cache_path.exists() and cache_path.stat().st_mtime >= mtime:
+        cached = json.loads(cache_path.read_text(encoding="utf-8"))
+        if cached.get("version") == PAYLOAD_VERSION:
+            return cached
+    payload = build_payload(csv_path)
+    try:
+        cache_path.write_text(dumps(payload), encoding="utf-8")
+    except OSError:
+        pass
+    return payload
+
+@st.cache_data(show_spinner=False, ttl=3600)
+def load_geojson(url: str) -> dict | None:
+    # downloaded once per server process (re-tried hourly); only NAME is read client-side, the other properties are dropped.
+    # A failure is cached as None too, so an offline server does not block every rerun; the page then fetches it itself.
+    try:
+        with urllib.request.urlopen(url, timeout=5) as r:
+            geo = json.load(r)
+        return {"type": "FeatureCollection",
+                "features": [{"type": "Feature", "properties": {"NAME": f["properties"].get("NAME")}, "geometry": f["geometry"]}
+                             for f in geo["features"]]}
+    except (OSError, ValueError, KeyError):
+        return None
+
+@st.cache_data(show_spinner=False)
+def load_blog(path: Path, mtime: float) -> str:
+    return path.read_text(encoding="utf-8")
+
 payload = load_payload(DATA_CSV, DATA_CSV.stat().st_mtime)
-PAYLOAD_JSON = json.dumps(payload)
+payload["geo"] = load_geojson(GEOJSON_URL)
+PAYLOAD_JSON = dumps(payload)
 
 HTML = r"""
 <!doctype html>
@@ -199,6 +205,8 @@ HTML = r"""
 <script src="https://unpkg.com/globe.gl@2.33.1/dist/globe.gl.min.js"></script>
 </head>
 <body>
+<script id="payload" type="application/json">__PAYLOAD__</script>
+<template id="blogHtml">__BLOG__</template>
 <div id="root"></div>
 
 <div class="info-panel" id="info">
@@ -238,12 +246,25 @@ HTML = r"""
 </div>
 
 <script>
-  const PAYLOAD = __PAYLOAD__;
+  const PAYLOAD = JSON.parse(document.getElementById('payload').textContent);
   const YEARS   = PAYLOAD.years;
-  const VALUES  = PAYLOAD.values;
+  const YEAR_IDX = new Map(YEARS.map((y, i) => [y, i]));
+  const COUNTRIES = PAYLOAD.countries;
+  const NC      = COUNTRIES.length;
+  const SCALE   = PAYLOAD.scale;
+  const MISSING = -32768;
+  function decodeGrid(b64){
+    const bin = atob(b64);
+    const bytes = new Uint8Array(bin.length);
+    for (let i = 0; i < bin.length; i++) bytes[i] = bin.charCodeAt(i);
+    return new Int16Array(bytes.buffer);
+  }
+  // GRID[metric][yearIdx*NC + countryIdx]
+  const GRID    = { anom: decodeGrid(PAYLOAD.values.anom), abs: decodeGrid(PAYLOAD.values.abs) };
+  const COUNTRY_IDX = new Map(COUNTRIES.map((c, i) => [c, i]));
+  const TREND   = PAYLOAD.trend;  // TREND[metric][countryIdx] = [slope per year, intercept]
   const CLIPS   = PAYLOAD.clips;
   const UNITS   = PAYLOAD.units;
-  const BLOG    = __BLOG__;
   const START_YEAR = '2024';
 
   const ALIASES = {
@@ -270,6 +291,7 @@ HTML = r"""
   };
 
   let selectedCountry = null;
+  let features = [];  // country polygons, set once after the GeoJSON loads
   let scheme = 'normal';
 
   function csvName(neName) {
@@ -278,44 +300,37 @@ HTML = r"""
     if (a === null) return null;
     return a.replaceAll("_"," ").replaceAll(".","").trim();
   }
-  function getValue(map, key){
-    if (!key) return null;
-    if (key in map) return map[key];
-    const space = key.replaceAll("-", " ");
-    if (space in map) return map[space];
-    const hyph  = key.replaceAll(" ", "-");
-    if (hyph in map) return map[hyph];
-    return null;
+  function countryIndex(key){
+    if (!key) return -1;
+    return COUNTRY_IDX.get(key)
+        ?? COUNTRY_IDX.get(key.replaceAll("-", " "))
+        ?? COUNTRY_IDX.get(key.replaceAll(" ", "-"))
+        ?? -1;
   }
+  function decode(q){ return q === MISSING ? null : q / SCALE; }
+  function yearRow(metricKey, yearIdx){ return GRID[metricKey].subarray(yearIdx*NC, (yearIdx+1)*NC); }
+  function valueAt(row, ci){ return ci < 0 ? null : decode(row[ci]); }
+  function getValue(row, key){ return valueAt(row, countryIndex(key)); }
   function seriesForCountry(name, metricKey){
-    const key = csvName(name);
-    const alt1 = key?.replaceAll('-', ' ');
-    const alt2 = key?.replaceAll(' ', '-');
+    const ci = countryIndex(csvName(name));
+    const grid = GRID[metricKey];
     const ys = [];
     for(let i=0;i<YEARS.length;i++){
-      const y = YEARS[i];
-      const map = VALUES[metricKey][y] || {};
-      const v = (key && key in map) ? map[key]
-            : (alt1 && alt1 in map) ? map[alt1]
-            : (alt2 && alt2 in map) ? map[alt2]
-            : null;
-      ys.push(v);
+      ys.push(ci < 0 ? null : decode(grid[i*NC + ci]));
     }
     return ys;
   }
-  function linreg(yvals){
-    const x = []; const y = [];
-    for(let i=0;i<yvals.length;i++){
-      if (yvals[i] != null && !isNaN(yvals[i])) { x.push(i); y.push(yvals[i]); }
+  // count/min/max of the non-null values in one pass (no filtered copy, no spread)
+  function seriesRange(data){
+    let n = 0, min = Infinity, max = -Infinity;
+    for (let i = 0; i < data.length; i++){
+      const v = data[i];
+      if (v == null || v !== v) continue;
+      if (v < min) min = v;
+      if (v > max) max = v;
+      n++;
     }
-    if (x.length < 2) return {slope:0, intercept: y[y.length-1] ?? 0};
-    const n = x.length;
-    const sx = x.reduce((a,b)=>a+b,0), sy = y.reduce((a,b)=>a+b,0);
-    const sxx = x.reduce((a,b)=>a+b*b,0), sxy = x.reduce((a,b,i)=>a+b*y[i],0);
-    const denom = n*sxx - sx*sx || 1e-9;
-    const slope = (n*sxy - sx*sy) / denom;
-    const intercept = (sy - slope*sx)/n;
-    return {slope, intercept};
+    return {n, min, max};
   }
   function sparklineSVG(svgEl, data, opts){
     const W=260, H=90, PADL=38, PADR=8, PADT=10, PADB=24;
@@ -324,92 +339,33 @@ HTML = r"""
     const yUnit  = opts?.yUnit  ?? '';
     svgEl.setAttribute('viewBox', `0 0 ${W} ${H}`);
     svgEl.innerHTML = '';
-    const valid = data.filter(v=>v!=null && !isNaN(v));
-    if (valid.length<2){ return; }
-    const min = Math.min(...valid), max = Math.max(...valid);
+    const {n, min, max} = seriesRange(data);
+    if (n<2){ return; }
     const rng = (max-min)||1e-6;
     const sx = (i)=> PADL + (W-PADL-PADR)*i/(data.length-1||1);
     const sy = (v)=> H-PADB - (H-PADT-PADB)*((v-min)/rng);
-    const ns = 'http://www.w3.org/2000/svg';
-    const gAxis = document.createElementNS(ns,'g');
-    gAxis.setAttribute('stroke','rgba(255,255,255,0.35)');
-    gAxis.setAttribute('stroke-width','1');
     const x0 = PADL, x1 = W-PADR, y0 = H-PADB, y1 = PADT;
-    const xAxis = document.createElementNS(ns,'line');
-    xAxis.setAttribute('x1', x0); xAxis.setAttribute('y1', y0);
-    xAxis.setAttribute('x2', x1); xAxis.setAttribute('y2', y0);
-    gAxis.appendChild(xAxis);
-    const yAxis = document.createElementNS(ns,'line');
-    yAxis.setAttribute('x1', x0); yAxis.setAttribute('y1', y0);
-    yAxis.setAttribute('x2', x0); yAxis.setAttribute('y2', y1);
-    gAxis.appendChild(yAxis);
-    const gGrid = document.createElementNS(ns,'g');
-    gGrid.setAttribute('stroke','rgba(255,255,255,0.15)');
-    gGrid.setAttribute('stroke-width','1');
-    const gLab = document.createElementNS(ns,'g');
-    gLab.setAttribute('fill','#ddd');
-    gLab.setAttribute('font-size','9');
-    gLab.setAttribute('font-family','system-ui, -apple-system, Segoe UI, Roboto, Helvetica, Arial, sans-serif');
+    // whole chart as one markup string -> a single innerHTML parse instead of per-node DOM calls
+    let axis = `<line x1="${x0}" y1="${y0}" x2="${x1}" y2="${y0}"/><line x1="${x0}" y1="${y0}" x2="${x0}" y2="${y1}"/>`;
+    let grid = '', labs = '';
     xTicks.forEach(t=>{
-      const idx = YEARS.indexOf(String(t));
+      const idx = YEAR_IDX.get(String(t)) ?? -1;
       if (idx<0) return;
       const X = sx(idx);
-      const tick = document.createElementNS(ns,'line');
-      tick.setAttribute('x1', X); tick.setAttribute('y1', y0);
-      tick.setAttribute('x2', X); tick.setAttribute('y2', y0+4);
-      gAxis.appendChild(tick);
-      const grid = document.createElementNS(ns,'line');
-      grid.setAttribute('x1', X); grid.setAttribute('y1', y0);
-      grid.setAttribute('x2', X); grid.setAttribute('y2', y1);
-      grid.setAttribute('stroke-dasharray','2,3');
-      gGrid.appendChild(grid);
-      const lab = document.createElementNS(ns,'text');
-      lab.setAttribute('x', X); lab.setAttribute('y', y0+14);
-      lab.setAttribute('text-anchor','middle');
-      lab.textContent = t;
-      gLab.appendChild(lab);
+      axis += `<line x1="${X}" y1="${y0}" x2="${X}" y2="${y0+4}"/>`;
+      grid += `<line x1="${X}" y1="${y0}" x2="${X}" y2="${y1}" stroke-dasharray="2,3"/>`;
+      labs += `<text x="${X}" y="${y0+14}" text-anchor="middle">${t}</text>`;
     });
     yTicks.forEach(tv=>{
       const Y = sy(tv);
-      const tick = document.createElementNS(ns,'line');
-      tick.setAttribute('x1', x0-4); tick.setAttribute('y1', Y);
-      tick.setAttribute('x2', x0);  tick.setAttribute('y2', Y);
-      gAxis.appendChild(tick);
-      const grid = document.createElementNS(ns,'line');
-      grid.setAttribute('x1', x0); grid.setAttribute('y1', Y);
-      grid.setAttribute('x2', x1); grid.setAttribute('y2', Y);
-      grid.setAttribute('stroke-dasharray','2,3');
-      gGrid.appendChild(grid);
-      const lab = document.createElementNS(ns,'text');
-      lab.setAttribute('x', x0-6); lab.setAttribute('y', Y+3);
-      lab.setAttribute('text-anchor','end');
-      lab.textContent = tv.toFixed( (Math.abs(tv)<5)?1:0 );
-      gLab.appendChild(lab);
+      axis += `<line x1="${x0-4}" y1="${Y}" x2="${x0}" y2="${Y}"/>`;
+      grid += `<line x1="${x0}" y1="${Y}" x2="${x1}" y2="${Y}" stroke-dasharray="2,3"/>`;
+      labs += `<text x="${x0-6}" y="${Y+3}" text-anchor="end">${tv.toFixed( (Math.abs(tv)<5)?1:0 )}</text>`;
     });
-    const yUnitLab = document.createElementNS(ns,'text');
-    yUnitLab.setAttribute('x', 10);
-    yUnitLab.setAttribute('y', 12);
-    yUnitLab.setAttribute('fill','#bbb');
-    yUnitLab.setAttribute('font-size','9');
-    yUnitLab.setAttribute('text-anchor','start');
-    yUnitLab.textContent = yUnit;
-    gLab.appendChild(yUnitLab);
-    const histPath = document.createElementNS(ns,'path');
-    const projPath = document.createElementNS(ns,'path');
-    
-    [histPath, projPath].forEach(p => {
-      p.setAttribute('fill','none');
-      p.setAttribute('stroke-linecap','round');
-      p.setAttribute('stroke-linejoin','round');
-      p.setAttribute('stroke-width','1.6');
-    });
-    histPath.setAttribute('stroke','white');
-    histPath.setAttribute('stroke-opacity','0.9');
-    projPath.setAttribute('stroke','yellow');
-    projPath.setAttribute('stroke-opacity','0.95');
-    
+    labs += `<text x="10" y="12" fill="#bbb" font-size="9" text-anchor="start">${yUnit}</text>`;
+
     const firstProjIdx = YEARS.findIndex(y => parseInt(y,10) > 2024);
-    
+
     let pathH = '', penH = false;
     const histEnd = (firstProjIdx === -1 ? data.length : firstProjIdx);
     for (let i = 0; i < histEnd; i++) {
@@ -419,8 +375,7 @@ HTML = r"""
       pathH += `${cmd}${sx(i).toFixed(2)},${sy(v).toFixed(2)} `;
       penH = true;
     }
-    histPath.setAttribute('d', pathH.trim());
-    
+
     let pathP = '', penP = false;
     if (firstProjIdx !== -1) {
       let lastHistIdx = -1;
@@ -440,15 +395,16 @@ HTML = r"""
         penP = true;
       }
     }
-    projPath.setAttribute('d', pathP.trim());
-    
-    const gPlot = document.createElementNS(ns,'g');
-    gPlot.appendChild(histPath);
-    if (pathP.trim().length) gPlot.appendChild(projPath);
-    
-    const gAll = document.createElementNS(ns,'g');
-    gAll.appendChild(gGrid); gAll.appendChild(gAxis); gAll.appendChild(gLab); gAll.appendChild(gPlot);
-    svgEl.appendChild(gAll);
+
+    const line = 'fill="none" stroke-linecap="round" stroke-linejoin="round" stroke-width="1.6"';
+    let plot = `<path ${line} stroke="white" stroke-opacity="0.9" d="${pathH.trim()}"/>`;
+    if (pathP.trim().length) plot += `<path ${line} stroke="yellow" stroke-opacity="0.95" d="${pathP.trim()}"/>`;
+
+    svgEl.innerHTML =
+      `<g><g stroke="rgba(255,255,255,0.15)" stroke-width="1">${grid}</g>` +
+      `<g stroke="rgba(255,255,255,0.35)" stroke-width="1">${axis}</g>` +
+      `<g fill="#ddd" font-size="9" font-family="system-ui, -apple-system, Segoe UI, Roboto, Helvetica, Arial, sans-serif">${labs}</g>` +
+      `<g>${plot}</g></g>`;
   }
 
   const DAY_TEX  = 'https://unpkg.com/three-globe/example/img/earth-blue-marble.jpg';
@@ -469,10 +425,32 @@ HTML = r"""
   globe.controls().addEventListener('start', () => globe.controls().autoRotate = false);
   globe.controls().addEventListener('end',   () => globe.controls().autoRotate = true);
 
+  // 256 prebuilt color strings per scheme, indexed by the clipped position t in [0,1]
+  function buildColorLut(sch){
+    const lut = new Array(256);
+    for (let i = 0; i < 256; i++){
+      const t = i / 255;
+      if (sch==='normal'){
+        const r = t<0.5 ? 2*t*255 : 255;
+        const g = t<0.5 ? 2*t*255 : 2*(1-t)*255;
+        const b = t<0.5 ? 255 : 2*(1-t)*255;
+        lut[i] = `rgba(${r|0},${g|0},${b|0},0.35)`;
+      } else {
+        const r = Math.round(59 + t*(180-59));
+        const g = Math.round(76 + t*(4-76));
+        const b = Math.round(192 + t*(38-192));
+        lut[i] = `rgba(${r},${Math.max(0,g)},${Math.max(0,b)},0.35)`;
+      }
+    }
+    return lut;
+  }
+  const COLOR_LUTS = { normal: buildColorLut('normal'), cb: buildColorLut('cb') };
+  const NO_DATA_COLOR = 'rgba(120,120,120,0.10)';
+
   let metric = PAYLOAD.default_metric || "anom";
-  const startIdx = YEARS.indexOf(START_YEAR);
+  const startIdx = YEAR_IDX.get(START_YEAR) ?? -1;
   let idx = (startIdx !== -1) ? startIdx : (YEARS.length - 1);
-  let valueMap = VALUES[metric][YEARS[idx]] || {};
+  let valueMap = yearRow(metric, idx);
   let colorScale = colorScaleFactory(metric, scheme);
 
   const rangeEl = document.getElementById('range');
@@ -492,21 +470,11 @@ HTML = r"""
 
   function colorScaleFactory(m, sch){
     const MIN = CLIPS[m][0], MAX = CLIPS[m][1];
+    const lut = COLOR_LUTS[sch];
     return function(v){
-      if (v==null || isNaN(v)) return 'rgba(120,120,120,0.10)';
+      if (v==null || isNaN(v)) return NO_DATA_COLOR;
       const x = Math.max(MIN, Math.min(MAX, v));
-      const t = (x - MIN) / (MAX - MIN);
-      if (sch==='normal'){
-        const r = t<0.5 ? 2*t*255 : 255;
-        const g = t<0.5 ? 2*t*255 : 2*(1-t)*255;
-        const b = t<0.5 ? 255 : 2*(1-t)*255;
-        return `rgba(${r|0},${g|0},${b|0},0.35)`;
-      } else {
-        const r = Math.round(59 + t*(180-59));
-        const g = Math.round(76 + t*(4-76));
-        const b = Math.round(192 + t*(38-192));
-        return `rgba(${r},${Math.max(0,g)},${Math.max(0,b)},0.35)`;
-      }
+      return lut[Math.round((x - MIN) / (MAX - MIN) * 255)];
     }
   }
 
@@ -519,20 +487,21 @@ HTML = r"""
     document.getElementById('btn-abs').classList.toggle('active',  metric==='abs');
   }
 
+  // accessors registered once; per year only the cached fields on the features change
+  function capColorFn(f){ return f.__color; }
+  function labelFn(f){ return f.__label; }
+
   function applyYear(newIdx){
     idx = Math.max(0, Math.min(YEARS.length-1, newIdx));
     const key = YEARS[idx];
-    valueMap = VALUES[metric][key] || {};
+    valueMap = yearRow(metric, idx);
     document.getElementById('sel').textContent = key;
-    globe
-      .polygonCapColor(({properties}) => {
-        const k = csvName(properties.NAME);
-        const v = getValue(valueMap, k);
-        return colorScale(v);
-      })
-      .polygonLabel(({ properties }) => String(properties.NAME || ""));
+    // one pass over the features per year; the globe then only reads the cached string
+    for (const f of features){
+      f.__color = colorScale(valueAt(valueMap, f.__ci));
+    }
+    globe.polygonCapColor(capColorFn);  // same reference, only triggers the color refresh
     if (selectedCountry){ openInfo(selectedCountry); }
-    globe.polygonsData(globe.polygonsData());
   }
 
   function applyMetric(newMetric){
@@ -553,14 +522,10 @@ HTML = r"""
     const currentYear = YEARS[idx];
     const latestYear  = YEARS[YEARS.length - 1];
     const key = csvName(name);
-    const currentVal =
-        VALUES[metric][currentYear]?.[key]
-     ?? VALUES[metric][currentYear]?.[key?.replaceAll('-', ' ')]
-     ?? VALUES[metric][currentYear]?.[key?.replaceAll(' ', '-')]
-     ?? null;
+    const currentVal = getValue(yearRow(metric, idx), key);
     const ysFull = seriesForCountry(name, metric);
-    const lr = linreg(ysFull);
-    const slopePerDecade = (lr.slope * 10);
+    const ci = countryIndex(key);
+    const slopePerDecade = (ci < 0 ? 0 : TREND[metric][ci][0]) * 10;
     const nowStr = (metric === 'anom'
       ? (currentVal != null ? `Temperature Anomaly: ${currentVal.toFixed(2)} °C` : 'no data')
       : (currentVal != null ? `Average Temperature: ${currentVal.toFixed(1)} °C` : 'no data')
@@ -572,8 +537,7 @@ HTML = r"""
       <div style="opacity:.8">Tip: the chart shows the full history; the snapshot follows the year slider.</div>`;
     const xTicks = [YEARS[0], '1950', '2000', latestYear];
     if (!xTicks.includes(latestYear)) xTicks.push(latestYear);
-    const valid = ysFull.filter(v => v != null && !isNaN(v));
-    const ymin = Math.min(...valid), ymax = Math.max(...valid);
+    const {min: ymin, max: ymax} = seriesRange(ysFull);
     const span = (ymax - ymin) || 1e-6;
     const yTicks = [ymin, ymin + span * 0.5, ymax];
     const yUnitShort = '°C';
@@ -586,14 +550,22 @@ HTML = r"""
     selectedCountry = null;
   }
 
-  fetch('https://raw.githubusercontent.com/nvkelso/natural-earth-vector/master/geojson/ne_110m_admin_0_countries.geojson')
-    .then(r => r.json())
+  (PAYLOAD.geo ? Promise.resolve(PAYLOAD.geo) : fetch(PAYLOAD.geo_url).then(r => r.json()))
     .then(geo => {
+      features = geo.features;
+      // polygon set is fixed: resolve alias + hyphen/space variants to a grid column once per feature
+      features.forEach(f => {
+        f.__key = csvName(f.properties.NAME);
+        f.__ci  = countryIndex(f.__key);
+        f.__label = String(f.properties.NAME || "");
+      });
       globe
-        .polygonsData(geo.features)
+        .polygonsData(features)
         .polygonAltitude(0.005)
         .polygonSideColor(() => 'rgba(0,0,0,0)')
         .polygonStrokeColor(() => 'rgba(255,255,255,0.55)')
+        .polygonCapColor(capColorFn)
+        .polygonLabel(labelFn)
         .onPolygonClick(({properties}) => {
           const shown = String(properties.NAME || "");
           openInfo(shown);
@@ -631,7 +603,7 @@ HTML = r"""
   function closeBlog(){ blog.classList.remove('show'); globe.controls().autoRotate = true; }
   document.getElementById('openBlog').onclick = openBlog;
   document.getElementById('blogClose').onclick = closeBlog;
-  blogContent.innerHTML = BLOG;
+  blogContent.innerHTML = document.getElementById('blogHtml').innerHTML;
   window.addEventListener('keydown', (e) => { if (e.key === 'Escape') { closeBlog(); closeInfo(); } });
   document.getElementById('infoClose').onclick = closeInfo;
 </script>
@@ -639,12 +611,16 @@ HTML = r"""
 </html>
 """
 
+# all placeholders in one pass over the template; "</" escaped so the JSON cannot close its <script>
+SLOTS = {
+    "PAYLOAD": PAYLOAD_JSON.replace("</", "<\\/"),
+    "UNIT": payload["units"][payload["default_metric"]],
+    "MIN": str(payload["clips"][payload["default_metric"]][0]),
+    "MAX": str(payload["clips"][payload["default_metric"]][1]),
+    "BLOG": load_blog(BLOG_PATH, BLOG_PATH.stat().st_mtime),
+}
 html(
-    HTML.replace("__PAYLOAD__", PAYLOAD_JSON)
-        .replace("__UNIT__", payload["units"][payload["default_metric"]])
-        .replace("__MIN__", str(payload["clips"][payload["default_metric"]][0]))
-        .replace("__MAX__", str(payload["clips"][payload["default_metric"]][1]))
-        .replace("__BLOG__", BLOG_JSON),
+    re.sub(r"__(PAYLOAD|UNIT|MIN|MAX|BLOG)__", lambda m: SLOTS[m.group(1)], HTML),
     height=10,
     scrolling=False
 )
@@ -1,8 +1,12 @@
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache, partial
 from pathlib import Path
 import re
 import io
 import pandas as pd
 import numpy as np
+import pyarrow as pa, pyarrow.compute as pc, pyarrow.csv as pcsv
 
 HERE = Path(__file__).resolve()
 DATA_DIR = HERE.parent
@@ -11,22 +15,26 @@ OUT_DIR = DATA_DIR / "temp_per_country"    # CSV output
 OUT_DIR.mkdir(parents=True, exist_ok=True)
 
 MONTHS = ["JAN","FEB","MAR","APR","MAY","JUN","JUL","AUG","SEP","OCT","NOV","DEC"]
-MONTH_MAP = {m:i+1 for i,m in enumerate(MONTHS)}
 MISSING = -999.0
 
+_SAFE_RE = re.compile(r"[^A-Za-z0-9]+")
+_HDR_RE = re.compile(r"Country\s*=\s*([^:]+)")
+_FN_RE = re.compile(r"\.(?P<name>[^.]+)\.tmp\.per$", re.IGNORECASE)
+
+@lru_cache(maxsize=None)
 def safe_name(s: str) -> str:
-    s = re.sub(r"[^A-Za-z0-9]+", "_", str(s).strip())
+    s = _SAFE_RE.sub("_", str(s).strip())
     return s.strip("_") or "UNKNOWN"
 
 def extract_country_from_header(lines: list[str]) -> str | None:
     for ln in lines[:8]:
-        m = re.search(r"Country\s*=\s*([^:]+)", ln)
+        m = _HDR_RE.search(ln)
         if m:
             return m.group(1).strip()
     return None
 
 def extract_country_from_filename(path: Path) -> str:
-    m = re.search(r"\.(?P<name>[^.]+)\.tmp\.per$", path.name, flags=re.IGNORECASE)
+    m = _FN_RE.search(path.name)
     if m:
         return m.group("name")
     parts = path.stem.split(".")
@@ -34,7 +42,7 @@ def extract_country_from_filename(path: Path) -> str:
         return parts[-2]
     return path.stem
 
-def parse_per_file(path: Path) -> pd.DataFrame:
+def parse_per_file(path: Path, with_date: bool = True) -> pd.DataFrame:
     txt = path.read_text(encoding="utf-8", errors="replace")
     lines = txt.splitlines()
 
@@ -48,27 +56,53 @@ def parse_per_file(path: Path) -> pd.DataFrame:
     if header_idx is None:
         raise ValueError(f"Header line with 'YEAR' not found in {path.name}")
 
-    table_str = "\n".join(lines[header_idx:])
-    df = pd.read_fwf(io.StringIO(table_str))
-
-    missing_months = [m for m in MONTHS if m not in df.columns]
+    header = lines[header_idx].split()
+    missing_months = [m for m in MONTHS if m not in header]
     if missing_months:
         raise ValueError(f"{path.name}: missing month columns: {missing_months}")
 
-    df = df[["YEAR"] + MONTHS].copy()
-
-    df.replace(MISSING, np.nan, inplace=True)
-
-    long = df.melt(id_vars=["YEAR"], value_vars=MONTHS, var_name="month_str", value_name="temp_c")
-    long["month"] = long["month_str"].map(MONTH_MAP).astype(int)
-    long["year"] = long["YEAR"].astype(int)
-    long["date"] = pd.to_datetime(dict(year=long["year"], month=long["month"], day=15), errors="coerce")
+    # numeric block straight into an (n_years, 13) array: YEAR + 12 months, long form via repeat/tile
+    arr = np.loadtxt(io.StringIO("\n".join(lines[header_idx + 1:])), ndmin=2,
+                     usecols=[header.index("YEAR")] + [header.index(m) for m in MONTHS])
+    years = arr[:, 0].astype(int)
+    temps = arr[:, 1:].ravel()
+    long = pd.DataFrame({
+        "year": np.repeat(years, 12),
+        "month": np.tile(np.arange(1, 13), len(years)),
+        "temp_c": np.where(temps == MISSING, np.nan, temps),
+    })
     long["country"] = country
-
-    long = long[["date","year","month","temp_c","country"]].sort_values(["date"])
-    return long
+    long = long.sort_values(["year","month"], kind="stable")
+    if not with_date:
+        return long[["year","month","temp_c","country"]]
+    # date (mid-month) only for the phase5 scripts, which require it in the country files
+    long["date"] = pd.to_datetime(long["year"] * 10000 + long["month"] * 100 + 15, format="%Y%m%d", errors="coerce")
+    return long[["date","year","month","temp_c","country"]]
+
+def write_csv(df: pd.DataFrame, path: Path) -> None:
+    # C++ CSV writer; date as date32 so the column stays YYYY-MM-DD like the pandas writer
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    if "date" in table.column_names:
+        table = table.set_column(table.column_names.index("date"), "date", pc.cast(table["date"], pa.date32()))
+    pcsv.write_csv(table, path)
+
+def _parse_and_write(fp: Path, with_date: bool = True) -> tuple[str, int, str | None]:
+    # runs in a worker process: parse + write there, only (file name, rows, error) travels back
+    try:
+        df = parse_per_file(fp, with_date)
+    except Exception as e:
+        return fp.name, 0, str(e)
+    country = df["country"].iloc[0]
+    out = OUT_DIR / f"{safe_name(country)}.csv"
+    write_csv(df, out)
+    return out.name, len(df), None
 
 def main():
+    ap = argparse.ArgumentParser(description="Convert CRU .per country files to monthly CSVs.")
+    ap.add_argument("--no_date", action="store_true",
+                    help="omit the mid-month date column (yearly_temp_data only needs year/month; phase5 scripts need date)")
+    args = ap.parse_args()
+
     per_files = sorted(IN_DIR.glob("*.per"))
     if not per_files:
         print(f"[ERROR] No .per files in {IN_DIR}")
@@ -76,20 +110,15 @@ def main():
 
     total_rows = 0
     written = 0
-    for fp in per_files:
-        try:
-            df = parse_per_file(fp)
-        except Exception as e:
-            print(f"[WARN] skip {fp.name}: {e}")
-            continue
-
-        country = df["country"].iloc[0]
-        out = OUT_DIR / f"{safe_name(country)}.csv"
-        df.to_csv(out, index=False)
-        written += 1
-        total_rows += len(df)
-        if written % 10 == 0:
-            print(f"[OK] {written} files written... (last: {out.name})")
+    with ProcessPoolExecutor() as ex:
+        for name, n_rows, err in ex.map(partial(_parse_and_write, with_date=not args.no_date), per_files, chunksize=8):
+            if err is not None:
+                print(f"[WARN] skip {name}: {err}")
+                continue
+            written += 1
+            total_rows += n_rows
+            if written % 10 == 0:
+                print(f"[OK] {written} files written... (last: {name})")
 
     print(f"[DONE] files: {written} | total rows: {total_rows} → {OUT_DIR}")
 